@@ -0,0 +1,244 @@
+# Iterative deepening alpha-beta player for the 81 cell game, an alternative engine to main.UCTPlayer
+# with the same get_move(opponentAction, validActions) and get_move_int(opponentMove, legalMoves) interfaces.
+#
+# The search is negamax with alpha-beta pruning over main.OXOState (using DoMove/UndoMove), a transposition
+# table keyed by the Zobrist hash, killer and history move ordering and a hard time limit per move.
+
+import random
+import time
+
+import main
+from bitboard import WIN_LINES
+
+WIN_SCORE = 100000
+
+# SMALL_THREATS[mine] - for every line where mine has exactly two cells, the bit of the missing cell
+SMALL_THREATS = tuple(
+    tuple(line & ~mine for line in WIN_LINES if bin(mine & line).count("1") == 2) for mine in range(512))
+
+# Weights of the heuristic evaluation
+SMALL_WIN_WEIGHT = 100
+BOARD_POSITION_WEIGHT = (10, 5, 10, 5, 20, 5, 10, 5, 10)  # extra for winning the centre and corner boards
+LARGE_THREAT_WEIGHT = 60  # two won boards in a line with the third still open
+SMALL_THREAT_WEIGHT = 8  # two cells in a line of an undecided small board with the third free
+CELL_WEIGHT = (2, 1, 2, 1, 3, 1, 2, 1, 2)  # centre and corner cells of undecided small boards
+FREE_MOVE_WEIGHT = 25  # the player to move may play in any board
+
+# Transposition table flags
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+def CountThreats(mine, theirs):
+    count = 0
+    for cell in SMALL_THREATS[mine]:
+        if not theirs & cell:
+            count += 1
+    return count
+
+
+def Evaluate(state):
+    """ Heuristic value of a non-terminal state for the player to move.
+    """
+    board = state.board
+    score = 0  # for player 1
+    for g in range(9):
+        bit = 1 << g
+        if board.p1Won & bit:
+            score += SMALL_WIN_WEIGHT + BOARD_POSITION_WEIGHT[g]
+        elif board.p2Won & bit:
+            score -= SMALL_WIN_WEIGHT + BOARD_POSITION_WEIGHT[g]
+        elif not board.decided & bit:
+            p1 = board.p1.ExtractSmallBoard(g)
+            p2 = board.p2.ExtractSmallBoard(g)
+            score += SMALL_THREAT_WEIGHT * (CountThreats(p1, p2) - CountThreats(p2, p1))
+            for i in range(9):
+                if (p1 >> i) & 1:
+                    score += CELL_WEIGHT[i]
+                elif (p2 >> i) & 1:
+                    score -= CELL_WEIGHT[i]
+
+    # Boards that are full without a winner block lines of the large board for both players
+    drawn = board.decided & ~(board.p1Won | board.p2Won)
+    score += LARGE_THREAT_WEIGHT * (CountThreats(board.p1Won, board.p2Won | drawn) -
+                                    CountThreats(board.p2Won, board.p1Won | drawn))
+
+    toMove = 1 if (state.playerJustMoved == 2 or state.playerJustMoved == 0) else 2
+    if toMove == 2:
+        score = -score
+    if board.lastMove != -1 and state.GetActiveBoard() == 9:
+        score += FREE_MOVE_WEIGHT  # the last move sent us to a decided board
+    return score
+
+
+class AlphaBetaSearch:
+    """ Iterative deepening negamax with alpha-beta pruning. The transposition table and the history
+        scores are kept between searches.
+    """
+
+    def __init__(self, table_size=500000):
+        self.tableSize = table_size
+        self.table = {}  # hash -> (depth, value, flag, move)
+        self.history = [[0] * 81 for player in range(2)]
+        self.killers = []
+        self.deadline = 0
+        self.nodes = 0
+
+    def Search(self, state, time_limit):
+        """ Search state for time_limit milliseconds. Return the best move of the deepest completed iteration.
+        """
+        self.deadline = time.monotonic() + 0.001 * time_limit
+        self.nodes = 0
+        if len(self.table) > self.tableSize:
+            self.table.clear()
+        moves = state.GetMoves()
+        best = random.choice(moves)
+        depth = 1
+        while depth <= 81:
+            self.killers = [[None, None] for ply in range(depth + 1)]
+            try:
+                value, move = self.Root(state, moves, depth, best)
+            except SearchTimeout:
+                break
+            best = move
+            if abs(value) >= WIN_SCORE - 81:  # proven result
+                break
+            depth += 1
+        return best
+
+    def Root(self, state, moves, depth, previous):
+        """ Search all root moves to depth, the best move of the previous iteration first.
+            Return the value and the best move.
+        """
+        alpha = -WIN_SCORE - 1
+        best = None
+        for m in self.OrderMoves(state, moves, 0, previous):
+            state.DoMove(m)
+            try:
+                value = -self.Negamax(state, depth - 1, 1, -WIN_SCORE - 1, -alpha)
+            finally:
+                state.UndoMove()
+            if best is None or value > alpha:
+                alpha = value
+                best = m
+        return alpha, best
+
+    def Negamax(self, state, depth, ply, alpha, beta):
+        """ Value of state for the player to move, within the alpha-beta window.
+        """
+        self.nodes += 1
+        if self.nodes & 255 == 0 and time.monotonic() > self.deadline:
+            raise SearchTimeout()
+
+        moves = state.GetMoves()
+        if moves == []:
+            result = state.GetResult(state.playerJustMoved)
+            return 0 if result == 0.5 else -int(result) * (WIN_SCORE - ply)
+        if depth == 0:
+            return Evaluate(state)
+
+        key = state.GetHash()
+        entry = self.table.get(key)
+        table_move = None
+        if entry is not None:
+            entry_depth, value, flag, table_move = entry
+            if entry_depth >= depth:
+                if flag == EXACT:
+                    return value
+                elif flag == LOWER:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    return value
+
+        original_alpha = alpha
+        best = -WIN_SCORE - 1
+        best_move = None
+        for m in self.OrderMoves(state, moves, ply, table_move):
+            state.DoMove(m)
+            try:
+                value = -self.Negamax(state, depth - 1, ply + 1, -beta, -alpha)
+            finally:
+                state.UndoMove()
+            if value > best:
+                best = value
+                best_move = m
+                if best > alpha:
+                    alpha = best
+                    if alpha >= beta:
+                        self.AddCutoff(state, m, depth, ply)
+                        break
+
+        if best <= original_alpha:
+            flag = UPPER
+        elif best >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table[key] = (depth, best, flag, best_move)
+        return best
+
+    def AddCutoff(self, state, move, depth, ply):
+        """ Remember a move that caused a beta cutoff as a killer of its ply and in the history scores.
+        """
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        toMove = 0 if (state.playerJustMoved == 2 or state.playerJustMoved == 0) else 1
+        self.history[toMove][move] += depth * depth
+
+    def OrderMoves(self, state, moves, ply, table_move=None):
+        """ Transposition table move first, then the killers of this ply, then the rest by history score.
+        """
+        toMove = 0 if (state.playerJustMoved == 2 or state.playerJustMoved == 0) else 1
+        history = self.history[toMove]
+        killers = self.killers[ply] if ply < len(self.killers) else (None, None)
+        ordered = sorted(moves, key=lambda m: history[m], reverse=True)
+        for m in (killers[1], killers[0], table_move):
+            if m is not None and m in moves:
+                ordered.remove(m)
+                ordered.insert(0, m)
+        return ordered
+
+
+class AlphaBetaPlayer:
+    def __init__(self, time_limit):
+        self.state = main.OXOState()
+        self.timeLimit = time_limit  # milliseconds per move
+        self.search = AlphaBetaSearch()
+
+    def get_move(self, opponentAction, validActions):
+        opponentMove = -1 if opponentAction[0] == opponentAction[1] == -1 else opponentAction[0] + opponentAction[1] * 9
+        m = self.get_move_int(opponentMove, len(validActions) > 0)
+        return list(main.MOVE_TO_XY[m]) if m is not None else None
+
+    def get_move_int(self, opponentMove, legalMoves):
+        if opponentMove != -1:
+            self.state.DoMove(opponentMove)
+
+        move = None
+        if legalMoves:
+            move = self.search.Search(self.state, self.timeLimit)
+            self.state.DoMove(move)
+
+        return move
+
+
+if __name__ == "__main__":
+    """ Play alpha-beta against UCT with the same time per move.
+    """
+    import tictactoe
+
+    games = 20
+    score = 0
+    for i in range(games):
+        result = tictactoe.Game(True, AlphaBetaPlayer(100), main.UCTPlayer(100)).play()
+        score += 1 if result == 1 else 0.5 if result == 0 else 0
+        print(i + 1, score)
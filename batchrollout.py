@@ -0,0 +1,179 @@
+# Batched random rollouts for the 81 cell game in main.py, using NumPy.
+# K positions are played to the end in lockstep, so the interpreter overhead of a move is paid
+# once per step for the whole batch instead of once per game.
+#
+# A batch is packed as
+#   boards - (K, 2, 9) uint16, the 9-bit small boards of player 1 and player 2
+#   active - (K,) int8, the small board the player to move is sent to, -1 for any board
+#   toMove - (K,) int8, the player to move, 1 or 2
+
+import random
+import time
+
+import numpy
+
+import main
+
+WIN_TABLE = numpy.array(main.SMALL_WIN, dtype=bool)
+COUNT_TABLE = numpy.array(main.SMALL_COUNT, dtype=numpy.int8)
+FULL = 0b111111111
+CELL_BITS = (1 << numpy.arange(9)).astype(numpy.uint16)
+
+
+def NewBatch(k):
+    """ Allocate the (boards, active, toMove) arrays of a batch of k positions.
+    """
+    return (numpy.zeros((k, 2, 9), dtype=numpy.uint16),
+            numpy.full(k, -1, dtype=numpy.int8),
+            numpy.zeros(k, dtype=numpy.int8))
+
+
+def PackState(state, boards, active, toMove, i):
+    """ Write the OXOState state into row i of a batch.
+    """
+    board = state.board
+    for g in range(9):
+        boards[i, 0, g] = board.p1.ExtractSmallBoard(g)
+        boards[i, 1, g] = board.p2.ExtractSmallBoard(g)
+    active[i] = main.NEXT_BOARD[board.lastMove] if board.lastMove != -1 else -1
+    toMove[i] = 1 if (state.playerJustMoved == 2 or state.playerJustMoved == 0) else 2
+
+
+def PackStates(states):
+    """ Pack a list of OXOState into (boards, active, toMove) arrays.
+    """
+    boards, active, toMove = NewBatch(len(states))
+    for i in range(len(states)):
+        PackState(states[i], boards, active, toMove, i)
+    return boards, active, toMove
+
+
+def BatchRollout(boards, active, toMove, playerjm, rng=None):
+    """ Play random moves in all K packed positions until every game is over.
+        The arrays are updated in place. playerjm is a (K,) array of the player each result is for.
+        Return (results, plies): results as in GameBoard.GetResult and the number of moves played per game.
+    """
+    if rng is None:
+        rng = numpy.random.default_rng(random.getrandbits(64))
+    k = len(boards)
+    cells = numpy.arange(9)
+    plies = numpy.zeros(k, dtype=numpy.int32)
+
+    won = WIN_TABLE[boards]  # (K, 2, 9)
+    occupied = boards[:, 0] | boards[:, 1]  # (K, 9)
+    decided = won.any(axis=1) | (occupied == FULL)
+    wonMask = (won * CELL_BITS).sum(axis=2)  # (K, 2) result boards
+    over = WIN_TABLE[wonMask].any(axis=1) | decided.all(axis=1)
+
+    alive = numpy.flatnonzero(~over)
+    while len(alive) > 0:
+        n = len(alive)
+        a = active[alive].astype(numpy.intp)
+
+        # Small boards the player may move in: the one it was sent to, or every undecided one
+        sent = (a >= 0) & ~decided[alive, a.clip(0)]
+        allowed = ~decided[alive]
+        allowed[sent] = False
+        allowed[sent, a[sent]] = True
+
+        # Pick the r-th free cell of the allowed boards, uniformly
+        free = (((occupied[alive][:, :, None] >> cells) & 1) == 0) & allowed[:, :, None]
+        free = free.reshape(n, 81)
+        r = (rng.random(n) * free.sum(axis=1)).astype(numpy.intp)
+        pick = numpy.argmax(free.cumsum(axis=1) > r[:, None], axis=1)
+        g = pick // 9
+        cell = pick % 9
+        bit = CELL_BITS[cell]
+
+        mover = toMove[alive].astype(numpy.intp) - 1
+        boards[alive, mover, g] |= bit
+        occupied[alive, g] |= bit
+        gameWon = WIN_TABLE[boards[alive, mover, g]]
+        won[alive, mover, g] = gameWon
+        wonMask[alive, mover] |= gameWon * CELL_BITS[g]
+        decided[alive, g] = gameWon | decided[alive, g] | (occupied[alive, g] == FULL)
+
+        plies[alive] += 1
+        active[alive] = cell
+        toMove[alive] = 3 - toMove[alive]
+        over[alive] = WIN_TABLE[wonMask[alive, mover]] | decided[alive].all(axis=1)
+        alive = alive[~over[alive]]
+
+    # Same scoring as GameBoard.GetResult
+    p1Wins = WIN_TABLE[wonMask[:, 0]]
+    p2Wins = WIN_TABLE[wonMask[:, 1]]
+    score = COUNT_TABLE[wonMask[:, 0]] - COUNT_TABLE[wonMask[:, 1]]
+    winner = numpy.where(p1Wins, 1, numpy.where(p2Wins, 2, numpy.where(score > 0, 1, numpy.where(score < 0, 2, 0))))
+    results = numpy.where(winner == 0, 0.5, numpy.where(winner == playerjm, 1.0, -1.0))
+    return results, plies
+
+
+def BatchUCT(rootstate, itermax, verbose=False, exploration=main.UCTK, batch_size=64, virtual_loss=0.0):
+    """ UCT with leaf batching: batch_size leaves are selected before any of them is backpropagated, and
+        their rollouts are played together by BatchRollout. Every node on the path to a pending leaf gets a
+        virtual visit with result -virtual_loss, which steers the following selections to other leaves.
+        Return the best move from the rootstate.
+    """
+    start_time = time.time()
+    rootnode = main.Node(state=rootstate)
+    rng = numpy.random.default_rng(random.getrandbits(64))
+
+    loops = 0
+    while True:
+        loops += 1
+        leaves = []
+        boards, active, toMove = NewBatch(batch_size)
+        for i in range(batch_size):
+            node = rootnode
+            state = rootstate
+            depth = 0
+
+            # Select
+            while node.untriedMoves == [] and node.childNodes != []:
+                node = node.UCTSelectChild(exploration)
+                state.DoMove(node.move)
+                depth += 1
+
+            # Expand
+            if node.untriedMoves != []:
+                m = random.choice(node.untriedMoves)
+                state.DoMove(m)
+                depth += 1
+                node = node.AddChild(m, state)
+
+            # Virtual loss
+            n = node
+            result = -virtual_loss
+            while n is not None:
+                n.Update(result)
+                result = -result
+                n = n.parentNode
+
+            leaves.append(node)
+            PackState(state, boards, active, toMove, i)
+            for d in range(depth):
+                state.UndoMove()
+
+        # Rollout
+        playerjm = numpy.array([node.playerJustMoved for node in leaves])
+        results, plies = BatchRollout(boards, active, toMove, playerjm, rng)
+
+        # Backpropagate, replacing the virtual visits with the real results
+        for i in range(len(leaves)):
+            node = leaves[i]
+            result = float(results[i]) / (1 + int(plies[i])) + virtual_loss
+            while node is not None:
+                node.wins += result
+                result = -result
+                node = node.parentNode
+
+        cur_time = time.time()
+        loop_time = (cur_time - start_time) / loops
+        if (cur_time + loop_time) > (start_time + 0.001 * itermax):
+            break
+
+    if verbose:
+        # print("Batches", loops, "of", batch_size)
+        pass
+
+    return max(rootnode.childNodes, key=lambda c: c.wins).move
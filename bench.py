@@ -0,0 +1,313 @@
+# Benchmarks of the game engine in main.py, the search and the tictactoe.py referee.
+#
+# Every benchmark runs on the same seeded set of positions, so runs on the same machine are comparable.
+# Throughput is measured in rounds of at least ROUND_TIME seconds, and the rounds of the benchmarks take turns.
+# Right before each round a reference workload that does not use the engine runs for a round too. The speed of
+# a machine can change by tens of percent within a minute, so the comparison uses the median over the rounds of
+# the ratio of the benchmark to the reference, which changes with the code but hardly with the machine.
+# The results are written as JSON and can be compared against a stored baseline, a benchmark that got
+# worse by more than its threshold is reported as a regression and the exit status is 1.
+#
+# Run with: python bench.py [--output results.json] [--baseline bench_baseline.json] [--save-baseline file]
+# bench_baseline.json is the stored baseline, regenerate it with --save-baseline on the machine you compare on.
+
+import argparse
+import gc
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+
+import main
+import ticplayer
+import tictactoe
+
+SEED = 20240611
+POSITIONS = 200
+MAX_PLIES = 50
+ROUND_TIME = 0.2  # seconds a round of a throughput benchmark runs at least
+
+# Default share a result may get worse than the baseline before it is a regression. The timings of whole
+# searches and games vary more between runs than the micro benchmarks.
+THRESHOLD = 0.10
+THRESHOLDS = {
+    "uct_iterations": 0.15,
+    "game_play": 0.15,
+    "combined_get_move_mean": 0.20,
+    "combined_get_move_p95": 0.25,
+}
+
+
+def MakePositions(count=POSITIONS, seed=SEED):
+    """ count non-terminal OXOStates reached by seeded random play of 0 to MAX_PLIES moves.
+    """
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        state = main.OXOState()
+        for ply in range(rng.randint(0, MAX_PLIES)):
+            moves = state.GetMoves()
+            if moves == []:
+                break
+            state.DoMove(rng.choice(moves))
+        if state.GetMoves() != []:
+            positions.append(state)
+    return positions
+
+
+def Rate(run, round_time=ROUND_TIME):
+    """ Time one round of calling run() until round_time seconds have passed. run returns the number of
+        operations it did, return the operations per second. Like timeit, the garbage collector is off
+        meanwhile, so collections do not land in some rounds and not in others.
+    """
+    ops = 0
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        while True:
+            ops += run()
+            elapsed = time.perf_counter() - start
+            if elapsed >= round_time:
+                return ops / elapsed
+    finally:
+        gc.enable()
+
+
+def BenchGetMoves(positions):
+    boards = [state.board for state in positions]
+
+    def run():
+        for i in range(20):
+            for board in boards:
+                board.GetMoves()
+        return 20 * len(boards)
+
+    return run, "calls/s"
+
+
+def BenchDoMove(positions):
+    pairs = [(state, state.GetMoves()) for state in positions]
+
+    def run():
+        ops = 0
+        for state, moves in pairs:
+            for m in moves:
+                state.DoMove(m)
+                state.UndoMove()
+            ops += len(moves)
+        return ops
+
+    return run, "moves/s"
+
+
+def BenchClone(positions):
+    def run():
+        for i in range(20):
+            for state in positions:
+                state.Clone()
+        return 20 * len(positions)
+
+    return run, "clones/s"
+
+
+def BenchRollout(positions):
+    def run():
+        random.seed(SEED)
+        for state in positions:
+            result, plies = state.DoRandomRollout(state.playerJustMoved)
+            for ply in range(plies):
+                state.UndoMove()
+        return len(positions)
+
+    return run, "rollouts/s"
+
+
+def BenchUCT(positions, milliseconds=100):
+    states = positions[::len(positions) // 10]
+
+    def run():
+        random.seed(SEED)
+        iterations = 0
+        for state in states:
+            rootnode = main.Node(state=state)
+            main.UCT(rootstate=state.Clone(), itermax=milliseconds, rootnode=rootnode)
+            iterations += rootnode.visits
+        return iterations
+
+    return run, "iterations/s"
+
+
+def BenchGamePlay(positions, games=20):
+    def run():
+        random.seed(SEED)
+        for i in range(games):
+            tictactoe.Game(True, ticplayer.BasicPlayer(), ticplayer.BasicPlayer()).play()
+        return games
+
+    return run, "games/s"
+
+
+def BenchReference():
+    """ Plain Python integer and table work of the kind the engine does, without using it, to measure the
+        speed of the machine with.
+    """
+    table = tuple(range(512))
+
+    def lookup(d):
+        return table[d & 511]
+
+    def run():
+        d = SEED
+        total = 0
+        for i in range(10000):
+            d = (d * 1103515245 + 12345) & 0xffffffff
+            total += lookup(d >> 7)
+        return 10000
+
+    return run, "steps/s"
+
+
+def CombinedLatencies(rounds, games=10):
+    """ get_move times of CombinedPlayer (without a network) against BasicPlayer, in microseconds, and the same
+        times in steps of the reference workload at its speed measured before each round of games.
+    """
+    latencies = []
+    relative = []
+    reference = BenchReference()[0]
+
+    class TimedPlayer(ticplayer.CombinedPlayer):
+        def get_move(self, opponentAction, validActions):
+            if len(validActions) == 0:
+                return None  # the final update at the end of the game, CombinedPlayer does not handle it
+            start = time.perf_counter()
+            move = ticplayer.CombinedPlayer.get_move(self, opponentAction, validActions)
+            latencies.append(1e6 * (time.perf_counter() - start))
+            relative.append(latencies[-1] * speed / 1e6)
+            return move
+
+    random.seed(SEED)
+    for r in range(rounds):
+        speed = Rate(reference)
+        for i in range(games):
+            player = TimedPlayer(None, ignoreNet=True)
+            if i % 2 == 0:
+                tictactoe.Game(True, player, ticplayer.BasicPlayer()).play()
+            else:
+                tictactoe.Game(True, ticplayer.BasicPlayer(), player).play()
+    latencies.sort()
+    relative.sort()
+    return latencies, relative
+
+
+# name -> benchmark(positions) returning (run, unit) for Rate; higher values are better
+THROUGHPUT = (
+    ("getmoves", BenchGetMoves),
+    ("domove_undomove", BenchDoMove),
+    ("clone", BenchClone),
+    ("random_rollout", BenchRollout),
+    ("uct_iterations", BenchUCT),
+    ("game_play", BenchGamePlay),
+)
+
+
+def RunBenchmarks(rounds=5, only=None, verbose=True):
+    """ Run the benchmarks whose names start with one of only, or all of them.
+        Return the results as a JSON-serialisable dict.
+    """
+
+    def wanted(name):
+        return only is None or any(name.startswith(prefix) for prefix in only)
+
+    positions = MakePositions()
+    benchmarks = [(name, bench(positions)) for name, bench in THROUGHPUT if wanted(name)]
+    reference = BenchReference()[0]
+    rates = dict((name, []) for name, bench in benchmarks)
+    ratios = dict((name, []) for name, bench in benchmarks)
+    for r in range(rounds):
+        for name, (run, unit) in benchmarks:
+            speed = Rate(reference)
+            rates[name].append(Rate(run))
+            ratios[name].append(rates[name][-1] / speed)
+    results = {}
+    for name, (run, unit) in benchmarks:
+        results[name] = {"value": statistics.median(rates[name]), "unit": unit, "higher_is_better": True,
+                         "relative": statistics.median(ratios[name])}
+        if verbose:
+            print("{:<24} {:>14.1f} {}".format(name, results[name]["value"], unit), file=sys.stderr)
+
+    if wanted("combined_get_move"):
+        latencies, relative = CombinedLatencies(rounds)
+        p95 = int(0.95 * (len(latencies) - 1))
+        results["combined_get_move_mean"] = {"value": statistics.mean(latencies), "unit": "us",
+                                             "higher_is_better": False, "relative": statistics.mean(relative)}
+        results["combined_get_move_p95"] = {"value": latencies[p95], "unit": "us", "higher_is_better": False,
+                                            "relative": relative[p95]}
+        if verbose:
+            for name in ("combined_get_move_mean", "combined_get_move_p95"):
+                print("{:<24} {:>14.1f} us".format(name, results[name]["value"]), file=sys.stderr)
+
+    return {
+        "seed": SEED,
+        "positions": POSITIONS,
+        "rounds": rounds,
+        "round_time": ROUND_TIME,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "benchmarks": results,
+    }
+
+
+def Compare(results, baseline, threshold=None):
+    """ Compare results against baseline, both as returned by RunBenchmarks.
+        Return a list of (name, change, regressed) with change the relative improvement, negative if worse.
+        The changes are of the values relative to the reference workload when both have them.
+        threshold overrides the per-benchmark thresholds.
+    """
+    comparison = []
+    for name, result in results["benchmarks"].items():
+        base = baseline["benchmarks"].get(name)
+        if base is None or base["value"] == 0:
+            continue
+        key = "relative" if "relative" in result and "relative" in base else "value"
+        change = result[key] / base[key] - 1
+        if not result["higher_is_better"]:
+            change = base[key] / result[key] - 1 if result[key] > 0 else 0.0
+        limit = threshold if threshold is not None else THRESHOLDS.get(name, THRESHOLD)
+        comparison.append((name, change, change < -limit))
+    return comparison
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the game engine and the search.")
+    parser.add_argument("--rounds", type=int, default=5, help="rounds per benchmark, the median is reported")
+    parser.add_argument("--only", nargs="*", help="run only the benchmarks starting with these names")
+    parser.add_argument("--output", help="write the results to this JSON file instead of stdout")
+    parser.add_argument("--baseline", help="compare against the results in this JSON file")
+    parser.add_argument("--save-baseline", help="also write the results to this JSON file as the new baseline")
+    parser.add_argument("--threshold", type=float, help="allowed slowdown for every benchmark, e.g. 0.1")
+    args = parser.parse_args()
+
+    results = RunBenchmarks(args.rounds, args.only)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            f.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = 0
+        for name, change, regressed in Compare(results, baseline, args.threshold):
+            print("{:<24} {:>+7.1%}{}".format(name, change, "  REGRESSION" if regressed else ""), file=sys.stderr)
+            regressions += regressed
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,44 @@
+# Bitboard tables of the ultimate tic-tac-toe board, shared by the game engine in main.py and the referee in
+# tictactoe.py so the two cannot drift apart.
+#
+# A large board is an 81-bit mask with bit x + 9 * y the cell (x, y), which is also the move number. A small
+# board is a 9-bit mask (bit i = cell i in the 012/345/678 layout), so testing, extracting and listing moves of
+# a small board are plain table lookups instead of branching. The small boards won by a player are a 9-bit mask
+# in the same layout, with board g at (g % 3, g // 3).
+
+WIN_LINES = (0b000000111, 0b000111000, 0b111000000,
+             0b001001001, 0b010010010, 0b100100100,
+             0b100010001, 0b001010100)
+
+# A full small board
+FULL = 0b111111111
+
+# SMALL_WIN[d] - True if the small board d contains a line
+SMALL_WIN = tuple(any((d & line) == line for line in WIN_LINES) for d in range(512))
+
+# SMALL_FULL[d] - True if the occupancy d leaves no free cell
+SMALL_FULL = tuple(d == FULL for d in range(512))
+
+# SMALL_COUNT[d] - number of cells set in d, e.g. of small boards won in a result board
+SMALL_COUNT = tuple(bin(d).count("1") for d in range(512))
+
+# SMALL_BOARD_SHIFT[g] - position of the top left cell of small board g in the 81-bit board
+SMALL_BOARD_SHIFT = tuple((g // 3) * 27 + (g % 3) * 3 for g in range(9))
+
+# Move translation tables, shared by all boards.
+# SMALL_TO_GLOBAL[g][i] - global move index of cell i of small board g
+SMALL_TO_GLOBAL = tuple(tuple(SMALL_BOARD_SHIFT[g] + (i // 3) * 9 + i % 3 for i in range(9)) for g in range(9))
+
+# SMALL_BOARD_OF_MOVE[move] - number of the small board a global move belongs to
+SMALL_BOARD_OF_MOVE = tuple((move // 27) * 3 + (move % 9) // 3 for move in range(81))
+
+# NEXT_BOARD[move] - number of the small board the opponent is sent to by a global move
+NEXT_BOARD = tuple(((move % 27) // 9) * 3 + move % 3 for move in range(81))
+
+# MOVE_TO_XY[move] - (x, y) coordinates of a global move, as used by tictactoe.Game
+MOVE_TO_XY = tuple((move % 9, move // 9) for move in range(81))
+
+# SMALL_FREE_MOVES[g][occupancy] - global move indices of the free cells of small board g, in row major order
+SMALL_FREE_MOVES = tuple(
+    tuple(tuple(SMALL_TO_GLOBAL[g][i] for i in range(9) if ((occupancy >> i) & 1) == 0) for occupancy in range(512))
+    for g in range(9))
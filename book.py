@@ -0,0 +1,113 @@
+# Opening book for the 81 cell game in main.py.
+#
+# The book is a flat binary file of fixed size records sorted by position hash, so it can be memory mapped
+# and binary searched without loading it. All processes that open the same file share its pages.
+# Positions are stored by their symmetry-canonical form (OXOState.GetCanonicalKey), and so are the moves.
+#
+# Build a book with: python book.py <file> <plies> <milliseconds per position>
+
+import hashlib
+import mmap
+import struct
+import sys
+
+import main
+
+# key - 64-bit hash of the canonical position, move - best move in the canonical position, visits - of that move
+RECORD = struct.Struct("<QB3xI")
+
+
+def PositionHash(key):
+    """ Hash a canonical key to 64 bits. Stable between processes and runs, unlike hash().
+    """
+    return int.from_bytes(hashlib.blake2b(key.to_bytes(21, "little"), digest_size=8).digest(), "little")
+
+
+def SearchPosition(state, itermax):
+    """ Run UCT on the unique moves of state. Return the root child with the most wins.
+    """
+    rootnode = main.Node(state=state)
+    rootnode.untriedMoves = state.GetUniqueMoves()
+    main.UCT(rootstate=state, itermax=itermax, rootnode=rootnode, symmetry=True)
+    return max(rootnode.childNodes, key=lambda c: c.wins)
+
+
+def BuildBook(path, plies, itermax, verbose=True):
+    """ Search every position of the first plies moves where the book player is to move and write the best
+        moves to path. The book player follows its own best moves, the opponent plays every unique reply, so
+        the book covers both colours.
+    """
+    records = {}
+
+    def book_move(state, depth):
+        if depth >= plies or state.GetMoves() == []:
+            return
+        key, s = state.GetCanonicalKey()
+        h = PositionHash(key)
+        if h in records:
+            return
+        best = SearchPosition(state, itermax)
+        records[h] = (main.SYMMETRY_MOVES[s][best.move], best.visits)
+        if verbose:
+            print(len(records), "ply", depth, "move", best.move, "visits", best.visits)
+        state.DoMove(best.move)
+        opponent_moves(state, depth + 1)
+        state.UndoMove()
+
+    def opponent_moves(state, depth):
+        if depth >= plies:
+            return
+        for m in state.GetUniqueMoves():
+            state.DoMove(m)
+            book_move(state, depth + 1)
+            state.UndoMove()
+
+    root = main.OXOState()
+    book_move(root, 0)
+    opponent_moves(root, 0)
+
+    with open(path, "wb") as f:
+        for h in sorted(records):
+            move, visits = records[h]
+            f.write(RECORD.pack(h, move, visits))
+    return len(records)
+
+
+class OpeningBook:
+    """ Read only view of a book file, memory mapped.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self.data) // RECORD.size
+
+    def Lookup(self, state):
+        """ Return the book move for state, or None if the position is not in the book.
+        """
+        key, s = state.GetCanonicalKey()
+        h = PositionHash(key)
+        lo = 0
+        hi = self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if RECORD.unpack_from(self.data, mid * RECORD.size)[0] < h:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self.size:
+            return None
+        record_hash, move, visits = RECORD.unpack_from(self.data, lo * RECORD.size)
+        if record_hash != h:
+            return None
+        move = main.SYMMETRY_MOVES[main.SYMMETRY_INVERSE[s]][move]
+        if move not in state.GetMoves():  # hash collision
+            return None
+        return move
+
+    def __len__(self):
+        return self.size
+
+
+if __name__ == "__main__":
+    print(BuildBook(sys.argv[1], int(sys.argv[2]), int(sys.argv[3])), "positions")
@@ -18,9 +18,25 @@
 from math import *
 import random
 import copy
+import gc
+import sys
 import math
+import threading
 import time
-from multiprocessing import Process, Queue, Lock
+from array import array
+from collections import OrderedDict
+from functools import partial
+from multiprocessing import Pool
+
+from bitboard import (SMALL_WIN, SMALL_FULL, SMALL_COUNT, SMALL_BOARD_SHIFT, SMALL_TO_GLOBAL,
+                      SMALL_BOARD_OF_MOVE, NEXT_BOARD, MOVE_TO_XY, SMALL_FREE_MOVES)
+
+try:
+    import numpy
+except ImportError:  # NodeStore selection falls back to a pure Python pass
+    numpy = None
+
+UCTK = 1.0  # default exploration constant of the UCB1 formula
 
 
 class BasicOXOState:
@@ -76,69 +92,151 @@ class BasicOXOState:
         return s
 
 
+# Zobrist keys: ZOBRIST[player - 1][move] for the pieces, ZOBRIST_ACTIVE[g] for the small board the player to
+# move is sent to, index 9 when it may move anywhere. Fixed seed, so hashes agree between processes.
+_zobrist_random = random.Random(0x5EED)
+ZOBRIST = tuple(tuple(_zobrist_random.getrandbits(64) for move in range(81)) for player in range(2))
+ZOBRIST_ACTIVE = tuple(_zobrist_random.getrandbits(64) for g in range(10))
+
+
+# Symmetries: the 8 rotations and reflections of the 9x9 grid, which also map small boards onto small boards.
+# They map legal moves onto legal moves and, as GameBoard.GetResult only looks at lines and counts of won
+# small boards, finished games onto finished games with the same result. Symmetric positions therefore have
+# the same value, which canonical keys, unique root moves and the opening book rely on.
+# SYMMETRY_MOVES[s][move] - image of a global move under symmetry s
+# SYMMETRY_BOARDS[s][g] - image of small board g, index 9 ("any board") maps to itself
+# SYMMETRY_INVERSE[s] - the symmetry that undoes s
+def _transform(s, x, y, n):
+    if s & 4:
+        x, y = y, x
+    if s & 1:
+        x = n - x
+    if s & 2:
+        y = n - y
+    return x, y
+
+
+SYMMETRY_MOVES = tuple(
+    tuple(_transform(s, move % 9, move // 9, 8)[0] + _transform(s, move % 9, move // 9, 8)[1] * 9 for move in range(81))
+    for s in range(8))
+SYMMETRY_BOARDS = tuple(
+    tuple(_transform(s, g % 3, g // 3, 2)[0] + _transform(s, g % 3, g // 3, 2)[1] * 3 for g in range(9)) + (9,)
+    for s in range(8))
+SYMMETRY_INVERSE = tuple(
+    next(t for t in range(8) if all(SYMMETRY_MOVES[t][SYMMETRY_MOVES[s][m]] == m for m in range(81))) for s in range(8))
+
+
+def _symmetry_row_tables(s):
+    # tables[y][bits] - image under s of the 9-bit row y of a large board
+    tables = []
+    for y in range(9):
+        table = [0] * 512
+        for bits in range(1, 512):
+            low = bits & -bits
+            table[bits] = table[bits ^ low] | (1 << SYMMETRY_MOVES[s][y * 9 + low.bit_length() - 1])
+        tables.append(tuple(table))
+    return tuple(tables)
+
+
+_SYMMETRY_ROWS = tuple(_symmetry_row_tables(s) for s in range(8))
+
+
+def TransformBoard(d, s):
+    """ Apply symmetry s to an 81-bit board.
+    """
+    rows = _SYMMETRY_ROWS[s]
+    result = 0
+    for y in range(9):
+        result |= rows[y][(d >> (y * 9)) & 0b111111111]
+    return result
+
+
 class GameBoard:
+    __slots__ = ('p1', 'p2', 'occupied', 'p1Won', 'p2Won', 'decided', 'lastMove')
+
     def __init__(self):
         self.p1 = Board(0)
         self.p2 = Board(0)
+        self.occupied = Board(0)  # p1 | p2
+        self.p1Won = 0  # 9-bit mask of the small boards won by player 1
+        self.p2Won = 0  # 9-bit mask of the small boards won by player 2
+        self.decided = 0  # 9-bit mask of the small boards that are won or full
         self.lastMove = -1
 
+    def Clone(self):
+        b = GameBoard.__new__(GameBoard)
+        b.p1 = Board(self.p1.d)
+        b.p2 = Board(self.p2.d)
+        b.occupied = Board(self.occupied.d)
+        b.p1Won = self.p1Won
+        b.p2Won = self.p2Won
+        b.decided = self.decided
+        b.lastMove = self.lastMove
+        return b
+
     def GetMoves(self):
         ## First check if any of the players won
-        if self.p1.CheckWin():
-            # self.p1.PrintLargeBoard(self.p1.GetData())
-            # self.p1.PrintSmallBoard(self.p1.GetResultBoard())
-            return []
-        if self.p2.CheckWin():
-            # self.p2.PrintLargeBoard(self.p2.GetData())
-            # self.p2.PrintSmallBoard(self.p2.GetResultBoard())
+        if SMALL_WIN[self.p1Won] or SMALL_WIN[self.p2Won]:
             return []
 
-        c = Board(self.p1.GetData() | self.p2.GetData())
         if self.lastMove == -1:
             return [i for i in range(81)]
 
-        gn = self.p1.GetNextMoveBoardNumber(self.lastMove)
+        gn = NEXT_BOARD[self.lastMove]
         ##Check if any moves available on that board
-        small_board = c.ExtractSmallBoard(gn)
-        if (0b111111111 - small_board) == 0 or \
-                self.p1.CheckSmallWin(self.p1.ExtractSmallBoard(gn)) or \
-                self.p2.CheckSmallWin(self.p2.ExtractSmallBoard(gn)):
+        if (self.decided >> gn) & 1:
             moves = []
             for g in range(9):
-                if not (self.p1.CheckSmallWin(self.p1.ExtractSmallBoard(g)) or
-                        self.p2.CheckSmallWin(self.p2.ExtractSmallBoard(g))):
-                    small_board = c.ExtractSmallBoard(g)
-                    moves.extend(
-                        [self.p1.TranslateMoveFromSmallBoard(i, g) for i in range(9) if ((small_board >> i) & 1) == 0])
+                if not (self.decided >> g) & 1:
+                    moves.extend(SMALL_FREE_MOVES[g][self.occupied.ExtractSmallBoard(g)])
             return moves
         else:
-            return [self.p1.TranslateMoveFromSmallBoard(i, gn) for i in range(9) if ((small_board >> i) & 1) == 0]
+            return list(SMALL_FREE_MOVES[gn][self.occupied.ExtractSmallBoard(gn)])
 
     def GetData(self):
-        return self.p1.GetData() | self.p2.GetData()
+        return self.occupied.GetData()
 
     def Move(self, move, player):
+        g = SMALL_BOARD_OF_MOVE[move]
         if player == 1:
             self.p1.Move(move)
-            pass
+            if SMALL_WIN[self.p1.ExtractSmallBoard(g)]:
+                self.p1Won |= (1 << g)
         elif player == 2:
             self.p2.Move(move)
-            pass
+            if SMALL_WIN[self.p2.ExtractSmallBoard(g)]:
+                self.p2Won |= (1 << g)
+        self.occupied.Move(move)
+        if ((self.p1Won | self.p2Won) >> g) & 1 or SMALL_FULL[self.occupied.ExtractSmallBoard(g)]:
+            self.decided |= (1 << g)
         self.lastMove = move
 
+    def Unmove(self, move, player, lastMove):
+        """ Take back a move made with Move, lastMove is the move that was played before it.
+        """
+        g = SMALL_BOARD_OF_MOVE[move]
+        if player == 1:
+            self.p1.Unmove(move)
+            if not SMALL_WIN[self.p1.ExtractSmallBoard(g)]:
+                self.p1Won &= ~(1 << g)
+        elif player == 2:
+            self.p2.Unmove(move)
+            if not SMALL_WIN[self.p2.ExtractSmallBoard(g)]:
+                self.p2Won &= ~(1 << g)
+        self.occupied.Unmove(move)
+        if not (((self.p1Won | self.p2Won) >> g) & 1 or SMALL_FULL[self.occupied.ExtractSmallBoard(g)]):
+            self.decided &= ~(1 << g)
+        self.lastMove = lastMove
+
     def GetResult(self, player):
-        if self.p1.CheckWin():
+        if SMALL_WIN[self.p1Won]:
             return 1.0 if player == 1 else -1.0
-        if self.p2.CheckWin():
+        if SMALL_WIN[self.p2Won]:
             return 1.0 if player == 2 else -1.0
 
-        player1_result_board = self.p1.GetResultBoard()
-        player2_result_board = self.p2.GetResultBoard()
-
-        score = 0
-        for i in range(9):
-            score += (player1_result_board & (1 << i))
-            score -= (player2_result_board & (1 << i))
+        # No line of small boards: the player with more small boards wins, as tictactoe.Game scores it.
+        # Which boards are won must not matter, or symmetric positions would have different values.
+        score = SMALL_COUNT[self.p1Won] - SMALL_COUNT[self.p2Won]
 
         return 0.5 if score == 0 else 1.0 if (score > 0 and player == 1 or score < 0 and player == 2) else -1.0
 
@@ -152,11 +250,9 @@ class GameBoard:
             if i % 9 == 8: s += "\n"
             if i % 27 == 26: s += "-----------------\n"
 
-        player1_result_board = self.p1.GetResultBoard()
-        player2_result_board = self.p2.GetResultBoard()
         for i in range(9):
-            p1 = 1 if (player1_result_board >> i) & 1 else 0
-            p2 = 2 if (player2_result_board >> i) & 1 else 0
+            p1 = 1 if (self.p1Won >> i) & 1 else 0
+            p2 = 2 if (self.p2Won >> i) & 1 else 0
             s += ".XO?"[p1 + p2]
             if i % 3 == 2: s += "\n"
 
@@ -164,28 +260,25 @@ class GameBoard:
 
 
 class Board:
+    __slots__ = ('d',)
+
     def __init__(self, d):
         self.d = d
-        self.mNSB = []
-        for i in range(81):
-            self.mNSB.append(math.floor((i % 27) / 9) * 3 + i % 3)
-
-        self.sTLM = []
-        for i in range(9):
-            offset = [i % 3 * 3, int(math.floor(i / 3)) * 3]
-            self.sTLM.append([((math.floor(ii / 3) + offset[1]) * 9 + ii % 3 + offset[0]) for ii in range(9)])
 
     def Move(self, move):
         self.d |= (1 << move)
 
+    def Unmove(self, move):
+        self.d &= ~(1 << move)
+
     def GetData(self):
         return self.d
 
     def GetNextMoveBoardNumber(self, move):
-        return self.mNSB[move]
+        return NEXT_BOARD[move]
 
     def TranslateMoveFromSmallBoard(self, move, boardNumber):
-        return self.sTLM[boardNumber][move]
+        return SMALL_TO_GLOBAL[boardNumber][move]
 
     # This does not take into account who has more little wins
     def CheckWin(self):
@@ -194,7 +287,8 @@ class Board:
     def GetResultBoard(self):
         result_board = 0
         for i in range(9):
-            result_board |= ((self.CheckSmallWin(self.ExtractSmallBoard(i)) << i) & (1 << i))
+            if SMALL_WIN[self.ExtractSmallBoard(i)]:
+                result_board |= (1 << i)
         return result_board
 
     def PrintSmallBoard(self, data):
@@ -216,47 +310,12 @@ class Board:
         print(s)
 
     def CheckSmallWin(self, d):
-        # 9 options
-        return (d & 0b000000111) == 0b000000111 or \
-               (d & 0b000111000) == 0b000111000 or \
-               (d & 0b111000000) == 0b111000000 or \
-               (d & 0b001001001) == 0b001001001 or \
-               (d & 0b010010010) == 0b010010010 or \
-               (d & 0b100100100) == 0b100100100 or \
-               (d & 0b100010001) == 0b100010001 or \
-               (d & 0b001010100) == 0b001010100
+        return SMALL_WIN[d]
 
     def ExtractSmallBoard(self, number):
-        board = 0
-        d = self.d
-        if number == 0:
-            board = ((d >> 0 & 0b111) << 0) | ((d >> 9 & 0b111) << 3) | ((d >> 18 & 0b111) << 6)
-            pass
-        elif number == 1:
-            board = ((d >> 3 & 0b111) << 0) | ((d >> 12 & 0b111) << 3) | ((d >> 21 & 0b111) << 6)
-            pass
-        elif number == 2:
-            board = ((d >> 6 & 0b111) << 0) | ((d >> 15 & 0b111) << 3) | ((d >> 24 & 0b111) << 6)
-            pass
-        elif number == 3:
-            board = ((d >> 27 & 0b111) << 0) | ((d >> 36 & 0b111) << 3) | ((d >> 45 & 0b111) << 6)
-            pass
-        elif number == 4:
-            board = ((d >> 30 & 0b111) << 0) | ((d >> 39 & 0b111) << 3) | ((d >> 48 & 0b111) << 6)
-            pass
-        elif number == 5:
-            board = ((d >> 33 & 0b111) << 0) | ((d >> 42 & 0b111) << 3) | ((d >> 51 & 0b111) << 6)
-            pass
-        elif number == 6:
-            board = ((d >> 54 & 0b111) << 0) | ((d >> 63 & 0b111) << 3) | ((d >> 72 & 0b111) << 6)
-            pass
-        elif number == 7:
-            board = ((d >> 57 & 0b111) << 0) | ((d >> 66 & 0b111) << 3) | ((d >> 75 & 0b111) << 6)
-            pass
-        elif number == 8:
-            board = ((d >> 60 & 0b111) << 0) | ((d >> 69 & 0b111) << 3) | ((d >> 78 & 0b111) << 6)
-            pass
-        return board
+        # The three rows of a small board are 9 bits apart in the large board
+        d = self.d >> SMALL_BOARD_SHIFT[number]
+        return (d & 0b111) | ((d >> 6) & 0b111000) | ((d >> 12) & 0b111000000)
 
 
 class OXOState:
@@ -273,14 +332,18 @@ class OXOState:
         self.lastMove = [-1, -1]
         self.board = GameBoard()
         self.currentGrid = -1
+        self.history = []  # board.lastMove before each move, so moves can be taken back
+        self.hash = 0  # Zobrist hash of the pieces, updated by DoMove and UndoMove
 
     def Clone(self):
         """ Create a deep clone of this game state.
         """
         st = OXOState()
         st.playerJustMoved = self.playerJustMoved
-        st.board = copy.deepcopy(self.board)
-        st.lastMove = copy.deepcopy(self.lastMove)
+        st.board = self.board.Clone()
+        st.lastMove = list(self.lastMove)
+        st.history = list(self.history)
+        st.hash = self.hash
         return st
 
     def DoMove(self, move):
@@ -293,7 +356,117 @@ class OXOState:
             # print(str(self.board), file=sys.stderr, flush=True)
             assert True
         self.playerJustMoved = 1 if (self.playerJustMoved == 2 or self.playerJustMoved == 0) else 2
+        self.history.append(self.board.lastMove)
         self.board.Move(move, self.playerJustMoved)
+        self.hash ^= ZOBRIST[self.playerJustMoved - 1][move]
+
+    def UndoMove(self):
+        """ Take back the last move made with DoMove, restoring the state exactly as it was before it.
+            Lets the search walk down the tree and back without cloning the state.
+        """
+        move = self.board.lastMove
+        self.hash ^= ZOBRIST[self.playerJustMoved - 1][move]
+        self.board.Unmove(move, self.playerJustMoved, self.history.pop())
+        self.playerJustMoved = (3 - self.playerJustMoved) if self.history else 0
+
+    def GetHash(self):
+        """ Get the Zobrist hash of the position: the pieces of both players and the small board the
+            player to move is sent to. Positions reached through different move orders hash the same.
+        """
+        return self.hash ^ ZOBRIST_ACTIVE[self.GetActiveBoard()]
+
+    def GetActiveBoard(self):
+        """ Get the small board the player to move has to play in, 9 if it may play in any undecided board.
+        """
+        board = self.board
+        if board.lastMove == -1:
+            return 9
+        gn = NEXT_BOARD[board.lastMove]
+        return 9 if (board.decided >> gn) & 1 else gn
+
+    def GetSymmetryKey(self, s):
+        """ Get the position transformed by symmetry s as a single int: both players' boards and the active board.
+        """
+        return TransformBoard(self.board.p1.d, s) | (TransformBoard(self.board.p2.d, s) << 81) | (
+                SYMMETRY_BOARDS[s][self.GetActiveBoard()] << 162)
+
+    def GetCanonicalKey(self):
+        """ Get the canonical form of the position, the smallest key over the 8 symmetries, and the symmetry
+            that produces it. Symmetric positions have the same canonical key, and a move m of this state is
+            SYMMETRY_MOVES[s][m] in the canonical position.
+        """
+        best_key = self.GetSymmetryKey(0)
+        best_s = 0
+        for s in range(1, 8):
+            key = self.GetSymmetryKey(s)
+            if key < best_key:
+                best_key = key
+                best_s = s
+        return best_key, best_s
+
+    def GetUniqueMoves(self):
+        """ Get the legal moves with only one move out of each set of moves that are equivalent under the
+            symmetries of this position. The moves left out lead to positions symmetric to, and so worth the
+            same as, the position after the move kept.
+        """
+        key = self.GetSymmetryKey(0)
+        stabilizer = [s for s in range(1, 8) if self.GetSymmetryKey(s) == key]
+        return [m for m in self.GetMoves() if all(SYMMETRY_MOVES[s][m] >= m for s in stabilizer)]
+
+    def CountPlayableCells(self):
+        """ Get the number of free cells in the small boards that are not decided yet.
+        """
+        board = self.board
+        count = 0
+        for g in range(9):
+            if not (board.decided >> g) & 1:
+                count += len(SMALL_FREE_MOVES[g][board.occupied.ExtractSmallBoard(g)])
+        return count
+
+    def GetRandomMove(self):
+        """ Get a uniformly random legal move straight from the board masks, without building the move list.
+            Return None if the game is over.
+        """
+        board = self.board
+        if SMALL_WIN[board.p1Won] or SMALL_WIN[board.p2Won]:
+            return None
+
+        if board.lastMove == -1:
+            return random.randrange(81)
+
+        gn = NEXT_BOARD[board.lastMove]
+        if not (board.decided >> gn) & 1:
+            return random.choice(SMALL_FREE_MOVES[gn][board.occupied.ExtractSmallBoard(gn)])
+
+        # Any undecided board - reservoir sampling keeps every free cell equally likely
+        move = None
+        count = 0
+        for g in range(9):
+            if not (board.decided >> g) & 1:
+                free = SMALL_FREE_MOVES[g][board.occupied.ExtractSmallBoard(g)]
+                count += len(free)
+                if random.randrange(count) < len(free):
+                    move = random.choice(free)
+        return move
+
+    def DoRandomRollout(self, playerjm, deadline=None, stop=None):
+        """ Play random moves until the game ends.
+            Return the result from the viewpoint of playerjm and the number of moves played, so the
+            rollout can be taken back with UndoMove.
+            With a deadline, the clock (time.monotonic()) is checked every 16 moves and the rollout is
+            abandoned once it has passed: the result is then None. The same goes for a threading.Event stop
+            once it is set.
+        """
+        plies = 0
+        m = self.GetRandomMove()
+        while m is not None:
+            self.DoMove(m)
+            plies += 1
+            if plies & 15 == 0 and (deadline is not None and time.monotonic() > deadline or
+                                    stop is not None and stop.is_set()):
+                return None, plies
+            m = self.GetRandomMove()
+        return self.GetResult(playerjm), plies
 
     def GetMoves(self):
         """ Get all possible moves from this state.
@@ -311,6 +484,10 @@ class OXOState:
         return str(self.board)
 
 
+PROVEN_WIN = 1  # Node.proven values, from the viewpoint of playerJustMoved
+PROVEN_LOSS = -1
+
+
 class Node:
     """ A node in the game tree. Note wins is always from the viewpoint of playerJustMoved.
         Crashes if state not specified.
@@ -324,15 +501,37 @@ class Node:
         self.visits = 0
         self.untriedMoves = state.GetMoves()  # future child nodes
         self.playerJustMoved = state.playerJustMoved  # the only part of the state that the Node needs later
-
-    def UCTSelectChild(self):
-        """ Use the UCB1 formula to select a child node. Often a constant UCTK is applied so we have
-            lambda c: c.wins/c.visits + UCTK * sqrt(2*log(self.visits)/c.visits to vary the amount of
-            exploration versus exploitation.
+        self.entry = None  # [wins, visits] shared with the transpositions of this node, see TranspositionTable
+        self.proven = None  # PROVEN_WIN or PROVEN_LOSS once the game-theoretic value is known (MCTS-Solver)
+
+    def UCTSelectChild(self, exploration=UCTK):
+        """ Use the UCB1 formula to select a child node:
+            c.wins/c.visits + exploration * sqrt(2*log(self.visits)/c.visits)
+            exploration varies the amount of exploration versus exploitation.
+            Proven children are never selected.
         """
-        s = sorted(self.childNodes, key=lambda c: c.wins / c.visits + math.sqrt(2 * math.log(self.visits) / c.visits))[
-            -1]
-        return s
+        log_visits = 2 * math.log(self.visits)
+        return max(self.childNodes, key=lambda c: -math.inf if c.proven is not None else
+                   c.Value() + exploration * math.sqrt(log_visits / c.visits))
+
+    def UpdateProof(self):
+        """ Prove this node from its children: it is lost if the player to move has a proven win, and won
+            if all its moves are expanded and proven losses for the player to move.
+            Return True if the node is proven.
+        """
+        if any(c.proven == PROVEN_WIN for c in self.childNodes):
+            self.proven = PROVEN_LOSS
+        elif self.untriedMoves == [] and self.childNodes != [] and all(
+                c.proven == PROVEN_LOSS for c in self.childNodes):
+            self.proven = PROVEN_WIN
+        return self.proven is not None
+
+    def Value(self):
+        """ Average result of this node, over all its transpositions if it has a table entry.
+        """
+        if self.entry is not None:
+            return self.entry[0] / self.entry[1]
+        return self.wins / self.visits
 
     def AddChild(self, m, s):
         """ Remove m from untriedMoves and add a new child node for this move.
@@ -343,11 +542,28 @@ class Node:
         self.childNodes.append(n)
         return n
 
+    def RemoveChild(self, n):
+        """ Undo AddChild for the child node n, which must not have been updated yet.
+        """
+        self.childNodes.remove(n)
+        self.untriedMoves.append(n.move)
+
+    def GetChild(self, move):
+        """ Return the child node reached by move, or None if it has not been expanded.
+        """
+        for c in self.childNodes:
+            if c.move == move:
+                return c
+        return None
+
     def Update(self, result):
         """ Update this node - one additional visit and result additional wins. result must be from the viewpoint of playerJustmoved.
         """
         self.visits += 1
         self.wins += result
+        if self.entry is not None:
+            self.entry[0] += result
+            self.entry[1] += 1
 
     def __repr__(self):
         return "[M:" + str(self.move) + " W/V:" + str(self.wins) + "/" + str(self.visits) + " U:" + str(
@@ -372,63 +588,584 @@ class Node:
         return s
 
 
-turn_start = time.time()
+class TranspositionTable:
+    """ Statistics shared between the nodes of transposed positions, keyed by OXOState.GetHash().
+        Holds at most capacity entries and evicts the least recently used one. Nodes keep updating an
+        evicted entry, it is just no longer shared with new nodes.
+    """
+
+    def __init__(self, capacity=1000000):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def Lookup(self, key):
+        """ Return the [wins, visits] entry for key, adding an empty one if there is none.
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+        self.misses += 1
+        entry = [0, 0]
+        self.entries[key] = entry
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return entry
+
+    def HitRate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def __repr__(self):
+        return "[TT size:" + str(len(self.entries)) + " hits:" + str(self.hits) + "/" + str(
+            self.hits + self.misses) + " (" + "{:.1%}".format(self.HitRate()) + ")]"
 
 
-def UCT(rootstate, itermax, verbose=False):
+# Below this many children the NumPy call overhead outweighs the pure Python pass
+VECTOR_SELECT_MIN_CHILDREN = 24
+
+
+class NodeStore:
+    """ A game tree kept as a struct of arrays: node statistics live in preallocated typed arrays indexed
+        by an integer node id instead of one Python object per node. Node 0 is the root.
+        The children of a node are allocated as one contiguous block when the node is first expanded, in
+        random order. The first childCount of them have been tried, the rest are the untried moves.
+        Note wins is always from the viewpoint of playerJustMoved.
+    """
+
+    def __init__(self, state, capacity=1024):
+        self.capacity = 0
+        self.size = 0
+        self.move = array('b')  # the move that got us to this node - -1 for the root node
+        self.parent = array('i')  # -1 for the root node
+        self.firstChild = array('i')  # -1 until the node is expanded
+        self.moveCount = array('B')  # number of children (legal moves) once expanded
+        self.childCount = array('B')  # number of children tried so far
+        self.playerJustMoved = array('b')
+        self.visits = array('i')
+        self.wins = array('d')
+        self.Grow(capacity)
+        self.AddNodes(1)
+        self.move[0] = -1
+        self.parent[0] = -1
+        self.playerJustMoved[0] = state.playerJustMoved
+
+    def Grow(self, capacity):
+        """ Extend all the arrays with zeroed entries up to capacity.
+        """
+        extra = capacity - self.capacity
+        for a in (self.move, self.parent, self.firstChild, self.moveCount, self.childCount,
+                  self.playerJustMoved, self.visits, self.wins):
+            a.frombytes(bytes(extra * a.itemsize))
+        self.capacity = capacity
+
+    def AddNodes(self, count):
+        """ Allocate count consecutive nodes, doubling the capacity if needed. Return the id of the first one.
+        """
+        first = self.size
+        if first + count > self.capacity:
+            self.Grow(max(self.capacity * 2, first + count))
+        self.size += count
+        for n in range(first, first + count):
+            self.firstChild[n] = -1
+        return first
+
+    def Expand(self, n, state):
+        """ Allocate the children of node n for all the moves available in state.
+        """
+        moves = state.GetMoves()
+        random.shuffle(moves)  # children are tried in this order
+        first = self.AddNodes(len(moves))
+        player = 1 if (state.playerJustMoved == 2 or state.playerJustMoved == 0) else 2
+        for i in range(len(moves)):
+            self.move[first + i] = moves[i]
+            self.parent[first + i] = n
+            self.playerJustMoved[first + i] = player
+        self.firstChild[n] = first
+        self.moveCount[n] = len(moves)
+
+    def UCTSelectChild(self, n, exploration=UCTK):
+        """ Use the UCB1 formula to select a child of the fully expanded node n. The children are
+            contiguous, so their statistics are evaluated in one vectorised pass and the best is an argmax.
+        """
+        first = self.firstChild[n]
+        count = self.moveCount[n]
+        log_visits = 2 * math.log(self.visits[n])
+        if numpy is not None and count >= VECTOR_SELECT_MIN_CHILDREN:
+            wins = numpy.frombuffer(self.wins, dtype=numpy.float64, count=count, offset=first * self.wins.itemsize)
+            visits = numpy.frombuffer(self.visits, dtype=numpy.int32, count=count, offset=first * self.visits.itemsize)
+            return first + int(numpy.argmax(wins / visits + exploration * numpy.sqrt(log_visits / visits)))
+        values = [w / v + exploration * math.sqrt(log_visits / v)
+                  for w, v in zip(self.wins[first:first + count], self.visits[first:first + count])]
+        return first + values.index(max(values))
+
+    def Backpropagate(self, n, result):
+        """ Add a visit with result to n and all its ancestors. result must be from the viewpoint of
+            playerJustMoved of n and is flipped at every level.
+        """
+        while n != -1:
+            self.visits[n] += 1
+            self.wins[n] += result
+            result = -result
+            n = self.parent[n]
+
+    def BestMove(self):
+        """ Return the root move with the most wins.
+        """
+        first = self.firstChild[0]
+        wins = self.wins[first:first + self.childCount[0]]
+        return self.move[first + wins.index(max(wins))]
+
+    def __repr__(self):
+        return "[NodeStore size:" + str(self.size) + " capacity:" + str(self.capacity) + "]"
+
+
+class EndgameSolver:
+    """ Exact negamax search with alpha-beta pruning for positions with few free cells left.
+        Values are 1 for a win, 0 for a draw and -1 for a loss. Moves that win a small board are searched
+        first, and values are kept in a small transposition table keyed by OXOState.GetHash().
+        A search that visits more than max_nodes positions, runs past its deadline or is stopped, is abandoned.
+    """
+
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+
+    def __init__(self, threshold=10, max_nodes=20000, table_size=200000):
+        self.threshold = threshold  # UCT only solves positions with at most this many playable cells
+        self.maxNodes = max_nodes
+        self.tableSize = table_size
+        self.table = {}  # hash -> (value, flag)
+        self.nodes = 0
+        self.aborted = False
+        self.deadline = None
+        self.stop = None
+
+    def Solve(self, state, deadline=None, stop=None):
+        """ Return the exact value of state for state.playerJustMoved, or None if the search was abandoned.
+            deadline is a time.monotonic() time, stop a threading.Event.
+        """
+        self.nodes = 0
+        self.aborted = False
+        self.deadline = deadline
+        self.stop = stop
+        if len(self.table) > self.tableSize:
+            self.table.clear()
+        value = -self.Negamax(state, -1, 1)
+        return None if self.aborted else value
+
+    def Negamax(self, state, alpha, beta):
+        """ Value of state for the player to move, within the alpha-beta window.
+        """
+        if self.aborted:  # unwind without searching the remaining moves
+            return 0
+        self.nodes += 1
+        if self.nodes > self.maxNodes or self.nodes & 255 == 0 and (
+                self.deadline is not None and time.monotonic() > self.deadline or
+                self.stop is not None and self.stop.is_set()):
+            self.aborted = True
+            return 0
+
+        moves = state.GetMoves()
+        if moves == []:
+            result = state.GetResult(state.playerJustMoved)
+            return 0 if result == 0.5 else -int(result)
+
+        key = state.GetHash()
+        entry = self.table.get(key)
+        if entry is not None:
+            value, flag = entry
+            if flag == EndgameSolver.EXACT:
+                return value
+            elif flag == EndgameSolver.LOWER:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                return value
+
+        original_alpha = alpha
+        best = -2
+        for m in self.OrderMoves(state, moves):
+            state.DoMove(m)
+            value = -self.Negamax(state, -beta, -alpha)
+            state.UndoMove()
+            if value > best:
+                best = value
+                if best > alpha:
+                    alpha = best
+                    if alpha >= beta:
+                        break
+
+        if not self.aborted:
+            if best <= original_alpha:
+                self.table[key] = (best, EndgameSolver.UPPER)
+            elif best >= beta:
+                self.table[key] = (best, EndgameSolver.LOWER)
+            else:
+                self.table[key] = (best, EndgameSolver.EXACT)
+        return best
+
+    def OrderMoves(self, state, moves):
+        """ Moves that win a small board for the player to move first.
+        """
+        board = state.board.p2 if state.playerJustMoved == 1 else state.board.p1
+        winning = []
+        others = []
+        for m in moves:
+            if SMALL_WIN[board.ExtractSmallBoard(SMALL_BOARD_OF_MOVE[m]) | (1 << NEXT_BOARD[m])]:
+                winning.append(m)
+            else:
+                others.append(m)
+        return winning + others
+
+
+class TimeManager:
+    """ Splits a game clock of total milliseconds, plus increment milliseconds per move, into move budgets.
+        The target time of a move depends on the expected number of moves left and on the game phase. Past
+        the target the search goes on, up to a hard maximum, while the move UCT would play (the one with the
+        most wins) is unstable: it changed recently, or the runner up is within TIME_CLOSE_Z standard errors of
+        its average reward but, as the error shrinks with the square root of the time, would be told apart by
+        the maximum. The errors come from the rewards of the search; visits cannot tell, as the rewards are
+        small next to the exploration term and the root children get nearly even visits. It stops before the
+        target when the runner up cannot catch up with the most visited move in the time that is left.
+    """
+
+    def __init__(self, total, increment=0):
+        self.remaining = total
+        self.increment = increment
+        self.moveStart = 0
+        self.target = 0
+        self.maximum = 0
+        self.bestMove = None
+        self.bestChanged = 0
+        self.checks = 0
+        self.rootWins = None  # rootnode.wins at the last call of ShouldStop
+        self.squares = 0.0  # sum of the squared rewards of the iterations of this move
+        self.rewards = 0
+
+    def StartMove(self, state, start=None):
+        """ Allocate the budget of the next move from state. Return the hard limit in milliseconds.
+            start is the time.monotonic() time the move started at, now by default.
+        """
+        self.moveStart = time.monotonic() if start is None else start
+        cells = state.CountPlayableCells()
+        moves_left = max(TIME_MIN_MOVES_LEFT, TIME_MOVES_PER_CELL * cells)
+        if cells > 60:
+            phase = TIME_OPENING_FACTOR
+        elif cells > 25:
+            phase = TIME_MIDDLEGAME_FACTOR
+        else:
+            phase = 1.0
+        available = max(0, self.remaining) + self.increment
+        self.target = min(phase * self.remaining / moves_left + self.increment, TIME_MAX_SHARE * available)
+        self.maximum = min(TIME_MAX_FACTOR * self.target, TIME_MAX_SHARE * available)
+        self.bestMove = None
+        self.bestChanged = self.moveStart
+        self.checks = 0
+        self.rootWins = None
+        self.squares = 0.0
+        self.rewards = 0
+        return self.maximum
+
+    def ShouldStop(self, rootnode, loops):
+        """ Decide after each UCT iteration whether to stop searching rootnode.
+        """
+        now = time.monotonic()
+        elapsed = 1000 * (now - self.moveStart)
+        if elapsed <= 0:  # a coarse clock has not moved since StartMove yet
+            return False
+        if elapsed + elapsed / loops >= self.maximum:
+            return True
+
+        # The root took the reward of the iteration that just finished, for the spread of the rewards
+        wins = rootnode.wins
+        if self.rootWins is not None:
+            reward = wins - self.rootWins
+            self.squares += reward * reward
+            self.rewards += 1
+        self.rootWins = wins
+
+        # Looking at the root children costs more than the iteration, only do it now and then
+        self.checks += 1
+        if self.checks % 16 != 0:
+            return False
+
+        best = None  # most visits
+        second = None
+        leader = None  # most wins, the move UCT returns
+        runnerUp = None
+        for c in rootnode.childNodes:
+            if best is None or c.visits > best.visits:
+                best, second = c, best
+            elif second is None or c.visits > second.visits:
+                second = c
+            if c.proven == PROVEN_LOSS:
+                continue
+            if leader is None or c.wins > leader.wins:
+                leader, runnerUp = c, leader
+            elif runnerUp is None or c.wins > runnerUp.wins:
+                runnerUp = c
+        if second is None:
+            return False
+        if leader is not None and leader.move != self.bestMove:
+            self.bestMove = leader.move
+            self.bestChanged = now
+
+        if elapsed < self.target:
+            return best.visits - second.visits > loops / elapsed * (self.target - elapsed)
+        if runnerUp is None or self.rewards == 0:
+            return True
+        recently_changed = 1000 * (now - self.bestChanged) < TIME_INSTABILITY_WINDOW * elapsed
+        gap = leader.wins / leader.visits - runnerUp.wins / runnerUp.visits
+        error = math.sqrt(self.squares / self.rewards * (1 / leader.visits + 1 / runnerUp.visits))
+        if error == 0:
+            return not recently_changed
+        z = gap / error
+        close = z < TIME_CLOSE_Z <= z * math.sqrt(self.maximum / elapsed)  # and told apart by the maximum
+        return not (recently_changed or close)
+
+    def EndMove(self):
+        """ Charge the time used by the move to the clock.
+        """
+        self.remaining += self.increment - 1000 * (time.monotonic() - self.moveStart)
+
+
+# TimeManager tuning
+TIME_MIN_MOVES_LEFT = 4
+TIME_MOVES_PER_CELL = 0.3  # own moves expected per playable cell, about 25 moves from the empty board
+TIME_OPENING_FACTOR = 0.7
+TIME_MIDDLEGAME_FACTOR = 1.3
+TIME_MAX_FACTOR = 2.0  # hard limit as a multiple of the target
+TIME_MAX_SHARE = 0.25  # never use more than this share of the clock on one move
+TIME_INSTABILITY_WINDOW = 0.1  # best move changed within this share of the elapsed time
+TIME_CLOSE_Z = 1.0  # runner up is within this many standard errors of the leader's average reward
+
+
+class SearchStats:
+    """ Profile of UCT searches, filled in when one is passed to UCT as stats.
+        Times are time.perf_counter() seconds summed over all iterations per phase: selection, expansion,
+        rollout (or endgame solve) and backpropagation, which includes taking the moves back.
+        Depths are of the leaf in the tree, without the rollout. rolloutLengths[n] counts rollouts of n moves.
+        tableLookups and tableHits count the TranspositionTable lookups of the searches and the ones that found
+        an entry, e.g. of a transposition or of a subtree dropped when the tree was re-rooted.
+        rootVisits[r] sums the visits of the root child ranked r by visits, over all searches.
+        The stats of several searches, games or processes add up with Merge.
+    """
+
+    def __init__(self):
+        self.searches = 0
+        self.iterations = 0
+        self.abandoned = 0  # iterations given up at the deadline
+        self.nodesCreated = 0
+        self.endgameSolves = 0
+        self.tableLookups = 0
+        self.tableHits = 0
+        self.selectTime = 0.0
+        self.expandTime = 0.0
+        self.rolloutTime = 0.0
+        self.backpropTime = 0.0
+        self.searchTime = 0.0
+        self.depthSum = 0
+        self.maxDepth = 0
+        self.rolloutLengths = [0] * 82
+        self.rootVisits = [0] * 81
+        self.lastRootVisits = {}  # move -> visits of the root children of the last search
+
+    def EndSearch(self, rootnode, elapsed):
+        self.searches += 1
+        self.searchTime += elapsed
+        children = sorted(rootnode.childNodes, key=lambda c: c.visits, reverse=True)
+        for r in range(len(children)):
+            self.rootVisits[r] += children[r].visits
+        self.lastRootVisits = {c.move: c.visits for c in children}
+
+    def Merge(self, other):
+        """ Add the counts and times of other to this one.
+        """
+        for name in ("searches", "iterations", "abandoned", "nodesCreated", "endgameSolves", "tableLookups",
+                     "tableHits", "selectTime", "expandTime", "rolloutTime", "backpropTime", "searchTime", "depthSum"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.maxDepth = max(self.maxDepth, other.maxDepth)
+        self.rolloutLengths = [a + b for a, b in zip(self.rolloutLengths, other.rolloutLengths)]
+        self.rootVisits = [a + b for a, b in zip(self.rootVisits, other.rootVisits)]
+        self.lastRootVisits = other.lastRootVisits
+        return self
+
+    def AverageDepth(self):
+        return self.depthSum / self.iterations if self.iterations else 0.0
+
+    def TableHitRate(self):
+        return self.tableHits / self.tableLookups if self.tableLookups else 0.0
+
+    def AverageRolloutLength(self):
+        rollouts = sum(self.rolloutLengths)
+        return sum(n * count for n, count in enumerate(self.rolloutLengths)) / rollouts if rollouts else 0.0
+
+    def __repr__(self):
+        phases = self.selectTime + self.expandTime + self.rolloutTime + self.backpropTime
+        share = lambda t: 100 * t / phases if phases else 0.0
+        return "[Searches:" + str(self.searches) + " Iterations:" + str(self.iterations) + \
+               " It/s:" + "{:.0f}".format(self.iterations / self.searchTime if self.searchTime else 0) + \
+               " Nodes:" + str(self.nodesCreated) + \
+               " Depth:" + "{:.1f}/{}".format(self.AverageDepth(), self.maxDepth) + \
+               " Rollout:" + "{:.1f}".format(self.AverageRolloutLength()) + \
+               (" TT hits:" + "{}/{} ({:.1%})".format(self.tableHits, self.tableLookups, self.TableHitRate())
+                if self.tableLookups else "") + \
+               " Select/Expand/Rollout/Backprop %:" + "{:.0f}/{:.0f}/{:.0f}/{:.0f}".format(
+            share(self.selectTime), share(self.expandTime), share(self.rolloutTime), share(self.backpropTime)) + "]"
+
+
+def UCT(rootstate, itermax, verbose=False, exploration=UCTK, rootnode=None, table=None, symmetry=False,
+        solver=False, endgame=None, timeManager=None, deadline=None, abandon=False, stop=None, stats=None):
     """ Conduct a UCT search for itermax iterations starting from rootstate.
-        Return the best move from the rootstate.
+        Return the best move from the rootstate. exploration is the UCB1 exploration constant.
+        rootnode continues the search in an existing tree for rootstate, a new tree is built if it is None.
+        With a TranspositionTable, nodes of transposed positions share their statistics in selection.
+        symmetry only searches one root move out of each set of symmetric ones and keys the table by the
+        canonical position, so symmetric positions share their statistics too.
+        solver marks terminal and endgame-solved nodes as proven wins or losses, backs the proofs up the tree,
+        stops selecting proven subtrees and stops early once the root is proven.
+        With an EndgameSolver, leaves with at most endgame.threshold playable cells get their exact value
+        instead of a rollout.
+        With a TimeManager the search stops when it says so, itermax is then only used by the caller.
+        deadline is a time.monotonic() time to return by, instead of itermax milliseconds from now. With abandon
+        the search runs up to the deadline and gives up the iteration in flight when it passes, as long rollouts
+        and endgame solves check the clock, rather than stopping when the next iteration might overrun.
+        stop is a threading.Event that ends the search early when it is set, used for pondering. Rollouts and
+        endgame solves check it too, so the iteration in flight is given up rather than finished.
+        A SearchStats passed as stats is updated with the profile of this search.
         Assumes 2 alternating players (player 1 starts), with game results in the range [0.0, 1.0]."""
-    global turn_start
-    turn_start = time.time()
-    start_time = turn_start
-
-    rootnode = Node(state=rootstate)
+    start_time = time.monotonic()
+    if deadline is None:
+        deadline = start_time + 0.001 * itermax
+    rolloutDeadline = deadline if abandon else None
+    if table is not None:
+        tableHits, tableMisses = table.hits, table.misses
+
+    if rootnode is None:
+        rootnode = Node(state=rootstate)
+        if symmetry:
+            rootnode.untriedMoves = rootstate.GetUniqueMoves()
+    if solver and rootnode.childNodes == []:
+        # A leaf proven by the endgame solver in an earlier search has no children to pick the move from,
+        # search it again and prove it from its children
+        rootnode.proven = None
 
     loops = 0;
     while True:
-        loop_start_time = time.time()
+        if solver and rootnode.proven is not None:
+            break
+        if stop is not None and stop.is_set():
+            break
         loops += 1
         # for i in range(itermax):
         node = rootnode
-        state = rootstate.Clone()
+        state = rootstate  # moves are taken back after each iteration, so no clone is needed
+        depth = 0
+        if stats is not None:
+            t0 = time.perf_counter()
 
         # Select
         while node.untriedMoves == [] and node.childNodes != []:  # node is fully expanded and non-terminal
-            node = node.UCTSelectChild()
+            node = node.UCTSelectChild(exploration)
             state.DoMove(node.move)
+            depth += 1
+        if stats is not None:
+            t1 = time.perf_counter()
 
         # Expand
+        expanded = False
         if node.untriedMoves != []:  # if we can expand (i.e. state/node is non-terminal)
             ## This is a place for improvement, here we can try to do a small simulation (just for the small grid)
             m = random.choice(node.untriedMoves)
             state.DoMove(m)
+            depth += 1
             node = node.AddChild(m, state)  # add child and descend tree
+            expanded = True
+            if table is not None:
+                node.entry = table.Lookup(state.GetCanonicalKey()[0] if symmetry else state.GetHash())
+        if stats is not None:
+            t2 = time.perf_counter()
+            treeDepth = depth
+
+        # Rollout, or the exact value in the endgame
+        value = None
+        if endgame is not None:
+            cells = state.CountPlayableCells()
+            if cells <= endgame.threshold:
+                value = endgame.Solve(state, rolloutDeadline, stop)
+        if value is not None:
+            result = 0.5 if value == 0 else float(value)
+            plies = 0  # nothing to take back, and marks the result as exact for the proof below
+            steps = 1 + cells  # discounted like a rollout that fills the board, so the two are comparable
+        else:
+            result, plies = state.DoRandomRollout(node.playerJustMoved, rolloutDeadline, stop)
+            steps = 1 + plies
+        depth += plies
+        if stats is not None:
+            t3 = time.perf_counter()
+
+        if result is None:  # the rollout passed the deadline or was stopped, give up this iteration
+            for i in range(depth):
+                state.UndoMove()
+            if expanded:
+                node.parentNode.RemoveChild(node)
+            if stats is not None:
+                stats.abandoned += 1
+                stats.selectTime += t1 - t0
+                stats.expandTime += t2 - t1
+                stats.rolloutTime += t3 - t2
+            break
 
-        # Rollout - this can often be made orders of magnitude quicker using a state.GetRandomMove() function
-        steps = 1
-        while state.GetMoves() != []:  # while state is non-terminal
-            steps += 1
-            m = random.choice(state.GetMoves())
-            state.DoMove(m)
+        # Prove
+        if solver and plies == 0 and node.proven is None:
+            if result == 1.0 or result == -1.0:
+                node.proven = PROVEN_WIN if result == 1.0 else PROVEN_LOSS
+                parent = node.parentNode
+                while parent is not None and parent.proven is None and parent.UpdateProof():
+                    parent = parent.parentNode
 
         # Backpropagate
-        last_player = node.playerJustMoved
-        result = (state.GetResult(node.playerJustMoved)) / steps
+        result = result / steps
         while node != None:  # backpropagate from the expanded node and work back to the root node
             node.Update(result)  # state is terminal. Update node with result from POV of node.playerJustMoved
             result = result * (-1)
             node = node.parentNode
 
-        cur_time = time.time()
-        loop_time = (cur_time - turn_start) / loops
+        # Restore the root state
+        for i in range(depth):
+            state.UndoMove()
+
+        if stats is not None:
+            stats.iterations += 1
+            stats.nodesCreated += expanded
+            stats.endgameSolves += value is not None
+            stats.depthSum += treeDepth
+            if treeDepth > stats.maxDepth:
+                stats.maxDepth = treeDepth
+            stats.rolloutLengths[plies] += 1
+            stats.selectTime += t1 - t0
+            stats.expandTime += t2 - t1
+            stats.rolloutTime += t3 - t2
+            stats.backpropTime += time.perf_counter() - t3
+
+        if timeManager is not None and timeManager.ShouldStop(rootnode, loops):
+            break
+
+        cur_time = time.monotonic()
+        loop_time = (cur_time - start_time) / loops
         # print("loop time:", loop_time)
-        if (cur_time + loop_time) > (start_time + 0.001 * itermax):
+        if (cur_time + (0 if abandon else loop_time)) > deadline:
             break
 
     # Output some information about the tree - can be omitted
     if (verbose):
         # print(rootnode.TreeToString(0))
+        # print(table)
         pass
     else:
         # print(rootnode.ChildrenToString())
@@ -443,43 +1180,296 @@ def UCT(rootstate, itermax, verbose=False):
     # print("Large loops", loops, file=sys.stderr, flush=True)
     # print("Large loops", loops)
     # print("Turn time:", time.time() - start_time, file=sys.stderr, flush=True)
-    return sorted(sorted(rootnode.childNodes, key=lambda c: c.wins / c.visits), key=lambda c: c.wins)[
-        -1].move  # return the move that was most visited
+    if stats is not None:
+        if table is not None:
+            stats.tableHits += table.hits - tableHits
+            stats.tableLookups += table.hits - tableHits + table.misses - tableMisses
+        stats.EndSearch(rootnode, time.monotonic() - start_time)
+    if rootnode.childNodes == []:  # no iteration finished in time
+        return rootstate.GetRandomMove()
+
+    candidates = rootnode.childNodes
+    if solver:
+        for c in rootnode.childNodes:
+            if c.proven == PROVEN_WIN:
+                return c.move
+        candidates = [c for c in rootnode.childNodes if c.proven != PROVEN_LOSS] or rootnode.childNodes
+    return max(candidates, key=lambda c: c.wins).move  # return the move with the most wins
+
+
+def UCTRootStatistics(rootstate, itermax, exploration=UCTK, symmetry=False, solver=False, endgame=None,
+                      deadline=None, abandon=False, stats=None):
+    """ Run UCT from rootstate with the options of UCT and return the statistics of the root children as
+        {move: (wins, visits, proven)}.
+    """
+    rootnode = Node(state=rootstate)
+    if symmetry:
+        rootnode.untriedMoves = rootstate.GetUniqueMoves()
+    UCT(rootstate=rootstate, itermax=itermax, exploration=exploration, rootnode=rootnode, symmetry=symmetry,
+        solver=solver, endgame=endgame, deadline=deadline, abandon=abandon, stats=stats)
+    return dict((c.move, (c.wins, c.visits, c.proven)) for c in rootnode.childNodes)
+
+
+def root_parallel_worker(args):
+    """ Pool worker of ParallelUCT, returns the root statistics and the SearchStats of the search, or None
+    """
+    rootstate, itermax, seed, exploration, symmetry, solver, endgame_threshold, deadline, abandon, profile = args
+    random.seed(seed)
+    endgame = EndgameSolver(endgame_threshold) if endgame_threshold > 0 else None
+    stats = SearchStats() if profile else None
+    return UCTRootStatistics(rootstate, itermax, exploration, symmetry, solver, endgame, deadline, abandon,
+                             stats), stats
+
+
+def ParallelUCT(rootstate, itermax, pool, jobs, exploration=UCTK, symmetry=False, solver=False, endgame_threshold=0,
+                deadline=None, abandon=False, stats=None):
+    """ Root parallel UCT: jobs independent searches of rootstate with different seeds run in the
+        multiprocessing pool for the same time budget of itermax milliseconds.
+        symmetry, solver, deadline and abandon are passed on to UCT, each search gets its own EndgameSolver
+        when endgame_threshold is above 0. The deadline is a time.monotonic() time, which is the same in all
+        the processes. The SearchStats of the searches are merged into stats.
+        Return the move with the most wins summed over all the searches. With the solver a move proven to win
+        by any of the searches is returned first, and a move proven to lose only if all moves are.
+    """
+    tasks = [(rootstate, itermax, random.getrandbits(32), exploration, symmetry, solver, endgame_threshold,
+              deadline, abandon, stats is not None) for i in range(jobs)]
+    totals = {}
+    for children, search_stats in pool.map(root_parallel_worker, tasks):
+        if search_stats is not None:
+            stats.Merge(search_stats)
+        for move, (wins, visits, proven) in children.items():
+            total_wins, total_visits, total_proven = totals.get(move, (0, 0, None))
+            totals[move] = (total_wins + wins, total_visits + visits, proven or total_proven)
+    if totals == {}:  # no search finished an iteration in time
+        return rootstate.GetRandomMove()
+    candidates = list(totals)
+    if solver:
+        for move in candidates:
+            if totals[move][2] == PROVEN_WIN:
+                return move
+        candidates = [move for move in candidates if totals[move][2] != PROVEN_LOSS] or candidates
+    return max(candidates, key=lambda m: totals[m][0])
+
+
+def ArrayUCT(rootstate, itermax, verbose=False, exploration=UCTK):
+    """ The same search as UCT, on a NodeStore instead of a tree of Node objects.
+        Return the best move from the rootstate.
+    """
+    start_time = time.monotonic()
+
+    store = NodeStore(rootstate)
+    firstChild = store.firstChild
+    moveCount = store.moveCount
+    childCount = store.childCount
+
+    loops = 0
+    while True:
+        loops += 1
+        node = 0
+        state = rootstate  # moves are taken back after each iteration, so no clone is needed
+        depth = 0
+
+        # Select and expand
+        while True:
+            if firstChild[node] == -1:
+                store.Expand(node, state)
+            if moveCount[node] == 0:  # terminal
+                break
+            if childCount[node] < moveCount[node]:  # expand the next untried child and descend to it
+                child = firstChild[node] + childCount[node]
+                childCount[node] += 1
+                node = child
+                state.DoMove(store.move[node])
+                depth += 1
+                break
+            node = store.UCTSelectChild(node, exploration)
+            state.DoMove(store.move[node])
+            depth += 1
+
+        # Rollout
+        result, plies = state.DoRandomRollout(store.playerJustMoved[node])
+        depth += plies
+
+        # Backpropagate
+        store.Backpropagate(node, result / (1 + plies))
+
+        # Restore the root state
+        for i in range(depth):
+            state.UndoMove()
+
+        cur_time = time.monotonic()
+        loop_time = (cur_time - start_time) / loops
+        if (cur_time + loop_time) > (start_time + 0.001 * itermax):
+            break
+
+    if verbose:
+        # print(store, loops)
+        pass
+
+    return store.BestMove()
+
+
+PONDER_LIMIT = 60000  # milliseconds a player ponders at most while waiting for the opponent
+# Seconds the ponder thread runs before it hands the interpreter lock over (sys.setswitchinterval), so the
+# main thread is not held up by the default 5 ms when it returns a move or the opponent thinks
+PONDER_SWITCH_INTERVAL = 0.0005
+
+# The switch interval is process wide, so it is lowered while any player ponders and put back when the last
+# one stops, not by each player, e.g. two pondering players in one process playing each other
+ponderLock = threading.Lock()
+ponderCount = 0
+ponderSwitchInterval = None  # sys.getswitchinterval() before the first player started pondering
+
+
+def PonderingStarted():
+    global ponderCount, ponderSwitchInterval
+    with ponderLock:
+        if ponderCount == 0:
+            ponderSwitchInterval = sys.getswitchinterval()
+            sys.setswitchinterval(PONDER_SWITCH_INTERVAL)
+        ponderCount += 1
+
+
+def PonderingStopped():
+    global ponderCount
+    with ponderLock:
+        ponderCount -= 1
+        if ponderCount == 0:
+            sys.setswitchinterval(ponderSwitchInterval)
 
 
 class UCTPlayer:
-    def __init__(self, max_iterations):
+    def __init__(self, max_iterations, reuse_tree=True, workers=1, transpositions=False, symmetry=True, book=None,
+                 solver=True, endgame_threshold=10, time_control=None, pause_gc=True, ponder=False, profile=False):
         self.state = OXOState()
         self.playerNum = 1
         self.maxIterations = max_iterations
         self.initialized = False
+        self.reuseTree = reuse_tree
+        self.tree = None  # search tree of self.state kept between turns
+        self.workers = workers  # more than 1 searches with ParallelUCT, without tree reuse
+        self.pool = None
+        if workers > 1 and transpositions:
+            raise ValueError("the searches of ParallelUCT cannot share a transposition table")
+        self.table = TranspositionTable() if transpositions else None  # kept for the whole game
+        self.symmetry = symmetry
+        self.book = book  # book.OpeningBook consulted before searching
+        self.solver = solver
+        self.endgame = EndgameSolver(endgame_threshold) if endgame_threshold > 0 else None
+        # (total, increment) milliseconds for the whole game, replaces max_iterations per move
+        self.timeManager = TimeManager(*time_control) if time_control is not None else None
+        self.pauseGC = pause_gc  # no garbage collection during the search, so a full collection cannot blow the deadline
+        self.ponder = ponder  # keep searching the retained tree in a background thread on the opponent's time
+        self.ponderThread = None
+        self.ponderStop = None
+        self.stats = SearchStats() if profile else None  # profile of all searches of the game, see UCT
         pass
 
+    def close(self):
+        self.StopPondering()
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def AdvanceTree(self, move):
+        """ Re-root the retained tree at the child reached by move and drop the rest of it.
+        """
+        if self.tree is not None:
+            self.tree = self.tree.GetChild(move)
+            if self.tree is not None:
+                self.tree.parentNode = None
+
+    def StartPondering(self):
+        """ Search the position after our move in a background thread until StopPondering is called, at most
+            PONDER_LIMIT milliseconds. The tree is kept, so the subtree of the opponent's actual move is reused.
+        """
+        if not self.ponder or self.workers > 1 or not self.reuseTree or self.state.GetMoves() == []:
+            return
+        if self.tree is None:
+            self.tree = Node(state=self.state)  # all the opponent's moves, even symmetric ones
+        self.ponderStop = threading.Event()
+        self.ponderThread = threading.Thread(target=UCT, kwargs=dict(
+            rootstate=self.state, itermax=PONDER_LIMIT, rootnode=self.tree, table=self.table, symmetry=self.symmetry,
+            solver=self.solver, endgame=self.endgame, stop=self.ponderStop))
+        self.ponderThread.daemon = True
+        PonderingStarted()
+        self.ponderThread.start()
+
+    def StopPondering(self):
+        if self.ponderThread is not None:
+            self.ponderStop.set()
+            self.ponderThread.join()
+            self.ponderThread = None
+            PonderingStopped()
+
     def get_move(self, opponentAction, validActions):
-        if opponentAction[0] == opponentAction[1] == -1:
-            self.playerNum = 2
-        else:
-            self.state.DoMove(opponentAction[0] + opponentAction[1] * 9)
+        opponentMove = -1 if opponentAction[0] == opponentAction[1] == -1 else opponentAction[0] + opponentAction[1] * 9
+        m = self.get_move_int(opponentMove, len(validActions) > 0)
+        return list(MOVE_TO_XY[m]) if m is not None else None
 
-        moves = self.state.GetMoves()
-        # print([[m % 9, math.floor(m / 9)] for m in moves], file=sys.stderr, flush=True)
-        move = None
-        if len(validActions) > 0:
-            m = None
-            if not self.initialized:
-                m = UCT(rootstate=self.state, itermax=995, verbose=True)
+    def get_move_int(self, opponentMove, legalMoves):
+        """ get_move with moves as ints, see tictactoe.Game. Only whether legalMoves is empty matters, the
+            legal moves come from self.state. The time spent stopping the ponder search counts against the move.
+        """
+        move_start = time.monotonic()
+        self.StopPondering()
+        pausedGC = self.pauseGC and gc.isenabled()
+        if pausedGC:
+            gc.disable()
+        try:
+            if opponentMove == -1:
+                self.playerNum = 2
+            else:
+                self.state.DoMove(opponentMove)
+                self.AdvanceTree(opponentMove)
+
+            # print([MOVE_TO_XY[m] for m in self.state.GetMoves()], file=sys.stderr, flush=True)
+            move = None
+            if legalMoves:
+                itermax = self.maxIterations if self.initialized else 995
                 self.initialized = True
+                if self.timeManager is not None:
+                    itermax = self.timeManager.StartMove(self.state, move_start)
+                deadline = move_start + 0.001 * itermax
+                m = None
+                if self.book is not None:
+                    m = self.book.Lookup(self.state)
+                if m is not None:
+                    pass
+                elif self.workers > 1:
+                    if self.pool is None:
+                        self.pool = Pool(self.workers)
+                    if self.timeManager is not None:
+                        itermax = self.timeManager.target  # the searches cannot stop early, use the target budget
+                        deadline = move_start + 0.001 * itermax
+                    m = ParallelUCT(rootstate=self.state, itermax=itermax, pool=self.pool, jobs=self.workers,
+                                    symmetry=self.symmetry, solver=self.solver,
+                                    endgame_threshold=self.endgame.threshold if self.endgame is not None else 0,
+                                    deadline=deadline, abandon=True, stats=self.stats)
+                else:
+                    if self.tree is None or not self.reuseTree:
+                        self.tree = Node(state=self.state)
+                        if self.symmetry:
+                            self.tree.untriedMoves = self.state.GetUniqueMoves()
+                    m = UCT(rootstate=self.state, itermax=itermax, verbose=True, rootnode=self.tree, table=self.table,
+                            symmetry=self.symmetry, solver=self.solver, endgame=self.endgame,
+                            timeManager=self.timeManager, deadline=deadline, abandon=True, stats=self.stats)
+                if self.timeManager is not None:
+                    self.timeManager.EndMove()
+                # print(m)
+                self.state.DoMove(m)
+                self.AdvanceTree(m)
+                move = m
+                self.StartPondering()
             else:
-                m = UCT(rootstate=self.state, itermax=self.maxIterations, verbose=True)
-            # print(m)
-            self.state.DoMove(m)
-            move = [m % 9, math.floor(m / 9)]
-        else:
-            pass
+                pass
 
-        # print(str(self.state), file=sys.stderr, flush=True)
+            # print(str(self.state), file=sys.stderr, flush=True)
 
-        return move
+            return move
+        finally:
+            if pausedGC:
+                gc.enable()
 
     # def getResult(self):
     #     result = self.state.GetResult(self.playerNum)
@@ -539,53 +1529,196 @@ def play_game():
     #     pass
     return result
 
-def worker(q, lock):
-    """thread worker function"""
-    # print("started")
-    result = play_game()
-    # print("finished")
-    lock.acquire()
-    win_rate = q.get()
-    # print("got q", win_rate)
-    if result == 1:
-        win_rate += 1
-    elif result == 0:
-        win_rate += 0.5
-
-    q.put(win_rate)
-    # print("put q", win_rate)
-    lock.release()
-    return
-
-def get_win_rate(number):
-    lock = Lock()
-    q = Queue()
-    win_rate = 0
-    q.put(win_rate)
-    ts = []
-    for i in range(number):
-        t = Process(target=worker, args=(q, lock,))
-        t.start()
-        ts.append(t)
-
-    for t in ts:
-        t.join()
-
-    win_rate = q.get()
-
-    return win_rate * (100/number)
-
-def evaluate_solution():
-    games = 1000;
-    divider = 0
-    win_rate_single = 0
-    jobs = 1
-    while games > 0:
-        temp_games = min(jobs, games)
-        games -= temp_games
-        divider += 1
-        win_rate_single += get_win_rate(temp_games)
-        print(win_rate_single / divider)
+def elo_from_score(score):
+    """ Elo difference that gives the expected score, clamped away from 0 and 1.
+    """
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def score_from_elo(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+SPRT_PRIOR = (1, 1, 1)  # wins, draws and losses added to the real ones when estimating the variance
+
+
+class SPRT:
+    """ Sequential probability ratio test of H0: elo = elo0 against H1: elo = elo1 on game results streamed in
+        with Add. Uses the normal approximation of the log likelihood ratio on the score of each game, and the
+        same per-game variance gives the confidence interval of the Elo difference.
+        alpha and beta are the false positive and false negative rates. The variance is estimated with the
+        SPRT_PRIOR pseudo games added, so a few one-sided results cannot make it collapse, and no decision
+        is taken before min_games games.
+    """
+
+    def __init__(self, elo0=0, elo1=5, alpha=0.05, beta=0.05, min_games=100):
+        self.elo0 = elo0
+        self.elo1 = elo1
+        self.lower = math.log(beta / (1 - alpha))  # accept H0 at or below this LLR
+        self.upper = math.log((1 - beta) / alpha)  # accept H1 at or above this LLR
+        self.minGames = min_games
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+
+    def Add(self, result):
+        """ Add a result as returned by tictactoe.Game.play, from the viewpoint of player 1.
+        """
+        if result == 1:
+            self.wins += 1
+        elif result == 0:
+            self.draws += 1
+        else:
+            self.losses += 1
+
+    def Games(self):
+        return self.wins + self.draws + self.losses
+
+    def Score(self):
+        return (self.wins + 0.5 * self.draws) / self.Games()
+
+    def Variance(self):
+        """ Variance of the score of a single game, regularised with the SPRT_PRIOR pseudo games.
+        """
+        wins = self.wins + SPRT_PRIOR[0]
+        draws = self.draws + SPRT_PRIOR[1]
+        losses = self.losses + SPRT_PRIOR[2]
+        n = wins + draws + losses
+        s = (wins + 0.5 * draws) / n
+        return (wins * (1 - s) ** 2 + draws * (0.5 - s) ** 2 + losses * s ** 2) / n
+
+    def Elo(self, z=1.96):
+        """ Return the Elo difference and the bounds of its confidence interval, 95% by default.
+        """
+        s = self.Score()
+        error = z * math.sqrt(self.Variance() / self.Games())
+        return elo_from_score(s), elo_from_score(s - error), elo_from_score(s + error)
+
+    def LLR(self):
+        if self.Games() < max(self.minGames, 1):
+            return 0.0
+        s0 = score_from_elo(self.elo0)
+        s1 = score_from_elo(self.elo1)
+        return self.Games() * (s1 - s0) * (2 * self.Score() - s0 - s1) / (2 * self.Variance())
+
+    def Decision(self):
+        """ Return "H1" (elo1 or better), "H0" (elo0 or worse), or None while the test goes on.
+        """
+        llr = self.LLR()
+        if llr >= self.upper:
+            return "H1"
+        if llr <= self.lower:
+            return "H0"
+        return None
+
+    def __repr__(self):
+        elo, low, high = self.Elo()
+        return "[W/D/L:" + str(self.wins) + "/" + str(self.draws) + "/" + str(self.losses) + " Elo:" + \
+               "{:.1f} [{:.1f}, {:.1f}]".format(elo, low, high) + " LLR:" + "{:.2f} ({:.2f}, {:.2f})".format(
+            self.LLR(), self.lower, self.upper) + "]"
+
+
+def simulate_sprt(elo, elo0=0, elo1=5, alpha=0.05, beta=0.05, draw_rate=0.1, runs=1000, max_games=200000,
+                  seed=1):
+    """ Run the SPRT on runs simulated matches between players elo apart, drawing draw_rate of the games.
+        Return the shares of runs that accepted H1, accepted H0 and ended undecided after max_games games.
+    """
+    rng = random.Random(seed)
+    score = score_from_elo(elo)
+    win = score - draw_rate / 2
+    counts = {"H1": 0, "H0": 0, None: 0}
+    for run in range(runs):
+        sprt = SPRT(elo0, elo1, alpha, beta)
+        decision = None
+        while decision is None and sprt.Games() < max_games:
+            r = rng.random()
+            sprt.Add(1 if r < win else 0 if r < win + draw_rate else 2)
+            decision = sprt.Decision()
+        counts[decision] += 1
+    return counts["H1"] / runs, counts["H0"] / runs, counts[None] / runs
+
+
+def check_sprt(elo0=0, elo1=5, alpha=0.05, beta=0.05, runs=1000):
+    """ Check the error rates of the SPRT on simulated matches: at elo0 it must accept H1 at most about alpha
+        of the time, at elo1 accept H0 at most about beta of the time. Allows 3 standard errors of the
+        simulation. Return the two simulated rates.
+    """
+    false_positive = simulate_sprt(elo0, elo0, elo1, alpha, beta, runs=runs)[0]
+    false_negative = simulate_sprt(elo1, elo0, elo1, alpha, beta, runs=runs, seed=2)[1]
+    for rate, limit in ((false_positive, alpha), (false_negative, beta)):
+        assert rate <= limit + 3 * math.sqrt(limit * (1 - limit) / runs), (false_positive, false_negative)
+    return false_positive, false_negative
+
+
+def tournament_worker(task):
+    """ Pool worker of run_tournament: play a batch of games between new players made by the two factories.
+        Return the results, as returned by tictactoe.Game.play, and the merged SearchStats of player1 if it
+        profiles its searches, else None.
+    """
+    player1, player2, games, seed = task
+    random.seed(seed)
+    results = []
+    stats = None
+    for i in range(games):
+        p1 = player1()
+        p2 = player2()
+        results.append(tictactoe.Game(True, p1, p2).play())
+        for p in (p1, p2):
+            if hasattr(p, "close"):
+                p.close()
+        if getattr(p1, "stats", None) is not None:
+            stats = (stats or SearchStats()).Merge(p1.stats)
+    return results, stats
+
+
+def run_tournament(games, player1=None, player2=None, jobs=None, batch=10, verbose=True, sprt=None, stats=None):
+    """ Play games matches between player1 and player2 on a pool of jobs worker processes, one per core by
+        default. The players are picklable factories, e.g. functools.partial(UCTPlayer, 100), called once per
+        game; they default to UCTPlayer(100) against ticplayer.BasicPlayer(). The workers live for the whole
+        tournament and send their results back every batch games, the running win rate is printed as they
+        come in. Pool workers cannot start processes, so players must not use UCTPlayer(workers=N).
+        With an SPRT the results are fed to it, its statistics are printed with the win rate, and the
+        tournament stops as soon as it reaches a decision.
+        The search profiles of player1, e.g. partial(UCTPlayer, 100, profile=True), are merged into stats,
+        which is printed at the end.
+        Return the win rate of player1 in percent, draws counting half.
+    """
+    if player1 is None:
+        player1 = partial(UCTPlayer, 100)
+    if player2 is None:
+        player2 = ticplayer.BasicPlayer
+    tasks = [(player1, player2, min(batch, games - i), random.getrandbits(32)) for i in range(0, games, batch)]
+    played = 0
+    score = 0
+    with Pool(jobs) as pool:
+        for results, batch_stats in pool.imap_unordered(tournament_worker, tasks):
+            if stats is not None and batch_stats is not None:
+                stats.Merge(batch_stats)
+            for result in results:
+                score += 1 if result == 1 else 0.5 if result == 0 else 0
+                if sprt is not None:
+                    sprt.Add(result)
+            played += len(results)
+            if verbose:
+                print(played, score * 100 / played, sprt if sprt is not None else "")
+            if sprt is not None and sprt.Decision() is not None:
+                break  # leaving the with block terminates the workers
+    if verbose and stats is not None:
+        print(stats)
+    return score * 100 / played
+
+
+def evaluate_solution(games=1000, elo0=None, elo1=None, alpha=0.05, beta=0.05):
+    """ Play up to games games of the default tournament. With Elo bounds, stop as soon as a sequential
+        probability ratio test decides between elo0 and elo1, and return its decision.
+    """
+    if elo0 is None or elo1 is None:
+        return run_tournament(games)
+    sprt = SPRT(elo0, elo1, alpha, beta)
+    run_tournament(games, sprt=sprt)
+    print(sprt.Decision(), sprt)
+    return sprt.Decision()
 
 # import matplotlib.pyplot as plt
 
@@ -615,7 +1748,10 @@ if __name__ == "__main__":
     """ Play a single game to the end using UCT for both players. 
     """
 
-    evaluate_solution()
+    if sys.argv[1:] == ["check-sprt"]:
+        print("SPRT false positive and false negative rates:", check_sprt())
+    else:
+        evaluate_solution()
     # while True:
     # s = time.time()
     # print(play_game())
@@ -3,6 +3,7 @@ import neat
 import pickle
 import random
 import copy
+import tictactoe
 
 class Player:
     def __init__(self, file):
@@ -52,6 +53,13 @@ class BasicPlayer:
         else:
             return None
 
+    def get_move_int(self, opponentMove, legalMoves):
+        # the same random number as random.choice on the list of actions, so games replay the same
+        if legalMoves:
+            return tictactoe.nth_move(legalMoves, random.randrange(tictactoe.count_bits(legalMoves)))
+        else:
+            return None
+
 def get_grid_from_cords(x, y):
     return int(math.floor(y/3)) * 3 + int(math.floor(x/3))
 
@@ -1,6 +1,34 @@
 import random
 import math
 
+from bitboard import FULL, SMALL_WIN, SMALL_COUNT, SMALL_BOARD_SHIFT, SMALL_TO_GLOBAL, SMALL_BOARD_OF_MOVE, NEXT_BOARD, \
+    SMALL_FREE_MOVES
+
+# The boards are integer bitboards laid out like main.GameBoard, see bitboard.py for the layout and the tables.
+#
+# Players talk to Game in one of two protocols:
+#   get_move(opponentAction, validActions) - the opponent's move as [x, y] ([-1, -1] before the first move) and
+#       the legal moves as a list of [x, y], returns [x, y]
+#   get_move_int(opponentMove, legalMoves) - the opponent's move as the int x + 9 * y (-1 before the first move)
+#       and the legal moves as an 81-bit mask, returns an int
+# Game uses get_move_int when a player has it and wraps other players in a ListPlayer. Once the game is over
+# the player to move is called once more with no legal moves, so it can see the last move.
+
+# BOARD_MASK[g] - the 81-bit mask of the cells of small board g
+BOARD_MASK = tuple(sum(1 << move for move in SMALL_TO_GLOBAL[g]) for g in range(9))
+
+# UNDECIDED_MASK[decided] - the 81-bit mask of the cells of the small boards not in the 9-bit mask decided
+UNDECIDED_MASK = tuple(sum(BOARD_MASK[g] for g in range(9) if not (decided >> g) & 1) for decided in range(512))
+
+# SMALL_MOVES[g][free] - the moves of the free cells of small board g, in row major order
+SMALL_MOVES = tuple(tuple(board[FULL & ~free] for free in range(512)) for board in SMALL_FREE_MOVES)
+
+# One [x, y] list per cell, shared by all the action lists handed to the players, which must not modify them
+CELL_ACTIONS = tuple([move % 9, move // 9] for move in range(81))
+
+# SMALL_ACTIONS[g][free] - the [x, y] actions of SMALL_MOVES[g][free]
+SMALL_ACTIONS = tuple(tuple(tuple(CELL_ACTIONS[move] for move in moves) for moves in board) for board in SMALL_MOVES)
+
 
 def get_grid_from_cords(x, y):
     return int(math.floor(y/3)) * 3 + int(math.floor(x/3))
@@ -11,6 +39,52 @@ def get_offset_for_grid(number):
         int(math.floor(number/3)) * 3
     ]
 
+def extract_small_board(d, g):
+    """ The 9-bit small board g of the 81-bit mask d.
+    """
+    d >>= SMALL_BOARD_SHIFT[g]
+    return (d & 7) | ((d >> 6) & 0o70) | ((d >> 12) & 0o700)
+
+def count_bits(d):
+    return bin(d).count("1")
+
+def actions_from_mask(mask):
+    """ The [x, y] actions of an 81-bit move mask, small board by small board, each in row major order.
+    """
+    actions = []
+    for g in range(9):
+        free = extract_small_board(mask, g)
+        if free:
+            actions.extend(SMALL_ACTIONS[g][free])
+    return actions
+
+def nth_move(mask, n):
+    """ The move of actions_from_mask(mask)[n], without building the list.
+    """
+    g = SMALL_BOARD_OF_MOVE[mask.bit_length() - 1]
+    if not mask & ~BOARD_MASK[g]:  # all in one small board, e.g. the one the player was sent to
+        return SMALL_MOVES[g][extract_small_board(mask, g)][n]
+    for g in range(9):
+        free = extract_small_board(mask, g)
+        if n < SMALL_COUNT[free]:
+            return SMALL_MOVES[g][free][n]
+        n -= SMALL_COUNT[free]
+    raise IndexError("move index out of range")
+
+class ListPlayer:
+    """ Adapts a player with get_move(opponentAction, validActions) on [x, y] lists to get_move_int.
+    """
+
+    def __init__(self, player):
+        self.player = player
+
+    def get_move_int(self, opponentMove, legalMoves):
+        action = self.player.get_move(CELL_ACTIONS[opponentMove] if opponentMove != -1 else [-1, -1],
+                                      actions_from_mask(legalMoves))
+        if action is None:
+            return None
+        return action[0] + action[1] * 9
+
 class Game:
     def __init__(self, large, player1, player2):
         self.data = []
@@ -24,74 +98,67 @@ class Game:
         else:
             self.activeGrid = 0
         self.lastMove = [-1,-1]
-        if self.large:
-            self.grids = []
-            for x in range(9):
-                self.grids.append(Grid())
-        else:
-            self.grids = [Grid()]
+        self.movers = [None,
+                       player1 if hasattr(player1, "get_move_int") else ListPlayer(player1),
+                       player2 if hasattr(player2, "get_move_int") else ListPlayer(player2)]
+        self.pieces = [0, 0, 0]  # 81-bit masks of player 1 and player 2 at index 1 and 2
+        self.won = [0, 0, 0]  # 9-bit masks of the small boards won by player 1 and player 2
+        # Small boards that are won or full. The small game is played on board 0 only.
+        self.decided = 0 if self.large else FULL & ~1
+        self.winner = 0
 
     def active_grid(self):
         return self.activeGrid
 
     def check_winner(self):
-        if self.large:
-            grid = Grid()
-            grid.set_grid([[self.grids[0].check_winner(),self.grids[1].check_winner(), self.grids[2].check_winner()],
-                           [self.grids[3].check_winner(), self.grids[4].check_winner(), self.grids[5].check_winner()],
-                           [self.grids[6].check_winner(), self.grids[7].check_winner(), self.grids[8].check_winner()]])
-            return grid.check_winner()
-        else:
-            return self.grids[0].check_winner()
-        return 0
+        return self.winner
+
+    def legal_moves(self):
+        """ The 81-bit mask of the legal moves, 0 once the game is over.
+        """
+        if self.winner > 0:
+            return 0
+        free = ~(self.pieces[1] | self.pieces[2])
+        if self.activeGrid != -1 and not (self.decided >> self.activeGrid) & 1:
+            return BOARD_MASK[self.activeGrid] & free
+        # here we need to return all possible actions
+        return UNDECIDED_MASK[self.decided] & free
 
     def get_available_actions(self):
-        actions = []
-        if self.check_winner() > 0:
-            return []
-        if self.activeGrid != -1:
-            actions = self.grids[self.activeGrid].get_available_actions(self.activeGrid)
-        if len(actions) == 0:
-            # here we need to return all possible actions
-            actions = []
-            for i in range(len(self.grids)):
-                actions.extend(self.grids[i].get_available_actions(i))
-
-        return actions
+        return actions_from_mask(self.legal_moves())
+
+    def move(self, player, move):
+        """ Put a piece of player on the cell move and update the decided small boards and the winner.
+        """
+        self.pieces[player] |= 1 << move
+        g = SMALL_BOARD_OF_MOVE[move]
+        if SMALL_WIN[extract_small_board(self.pieces[player], g)]:
+            self.won[player] |= 1 << g
+            self.decided |= 1 << g
+            if SMALL_WIN[self.won[player]] or not self.large:
+                self.winner = player
+        elif extract_small_board(self.pieces[1] | self.pieces[2], g) == FULL:
+            self.decided |= 1 << g
 
     def printGrid(self):
         print('###############')
         print(self.lastMove)
-        if self.large:
-            grid = []
-            for row in range(9):
-                grid.append([0]*9)
-                for col in range(9):
-                    gridNum = get_grid_from_cords(col, row)
-                    grid_col = col%3
-                    grid_row = row%3
-                    grid[row][col] = self.grids[gridNum].get_grid()[grid_row][grid_col]
-            for row in grid:
-                print(row)
-        else:
-            for row in range(3):
-                print(self.grids[0].get_grid()[row])
+        size = 9 if self.large else 3
+        for row in range(size):
+            print([1 if (self.pieces[1] >> (col + row * 9)) & 1 else 2 if (self.pieces[2] >> (col + row * 9)) & 1
+                   else 0 for col in range(size)])
         print('---------------')
         return 0
 
     def play(self, debug=False):
         result = -1
-        while self.check_winner() == 0:
+        move = -1
+        while self.winner == 0:
             self.turn += 1
-            actions = self.get_available_actions()
-            if len(actions) == 0:
+            legal = self.legal_moves()
+            if legal == 0:
                 # check who got more little wins
-                score = 0
-                for grid in self.grids:
-                    if grid.check_winner() == 1:
-                        score += 1
-                    elif grid.check_winner() == 2:
-                        score -= 1
+                score = count_bits(self.won[1]) - count_bits(self.won[2])
                 if score > 0:
                     result = 1
                 elif score < 0:
@@ -100,77 +167,58 @@ class Game:
                     result = 0
                 break
             else:
-                if self.curPlayer == 1:
-                    self.lastMove = self.player1.get_move(self.lastMove, actions)
-                else:
-                    self.lastMove = self.player2.get_move(self.lastMove, actions)
-
-                gridNum = get_grid_from_cords(self.lastMove[0], self.lastMove[1])
-                gridNumOffset = get_offset_for_grid(gridNum)
-
-                self.grids[gridNum].play(self.curPlayer,
-                                                 self.lastMove[0] - gridNumOffset[0],
-                                                 self.lastMove[1] - gridNumOffset[1])
+                move = self.movers[self.curPlayer].get_move_int(move, legal)
+                self.lastMove = CELL_ACTIONS[move]
+                self.move(self.curPlayer, move)
 
                 self.curPlayer = 1 if self.curPlayer == 2 else 2
                 if self.large:
-                    self.activeGrid = self.lastMove[0]%3 + self.lastMove[1]%3 * 3
+                    self.activeGrid = NEXT_BOARD[move]
 
             if debug:
                 self.printGrid()
 
         # update the state of the player
-        if self.curPlayer == 1:
-            self.player1.get_move(self.lastMove, [])
-        else:
-            self.player2.get_move(self.lastMove, [])
+        self.movers[self.curPlayer].get_move_int(move, 0)
 
         if result == -1:
-            result = self.check_winner()
+            result = self.winner
 
         return result
 
 
 
 class Grid:
+    """ A single small board, as the 9-bit masks of player 1 and player 2.
+    """
+
     def __init__(self):
-        self.grid = [[0,0,0],
-                     [0,0,0],
-                     [0,0,0]]
+        self.pieces = [0, 0, 0]
 
     def set_grid(self, grid):
-        self.grid = grid
+        self.pieces = [0, 0, 0]
+        for row in range(3):
+            for col in range(3):
+                if grid[row][col] > 0:
+                    self.pieces[grid[row][col]] |= 1 << (col + row * 3)
 
     def get_grid(self):
-        return self.grid
+        return [[1 if (self.pieces[1] >> (col + row * 3)) & 1 else 2 if (self.pieces[2] >> (col + row * 3)) & 1
+                 else 0 for col in range(3)] for row in range(3)]
 
     def get_available_actions(self, activeGrid):
-        actions = []
-        if self.check_winner() == 0:
-            for row in range(len(self.grid)):
-                for col in range(len(self.grid[row])):
-                    if self.grid[row][col] == 0:
-                        gridOffset = get_offset_for_grid(activeGrid)
-                        actions.append([col + gridOffset[0], row + gridOffset[1]])
-        return actions
+        if self.check_winner() != 0:
+            return []
+        return list(SMALL_ACTIONS[activeGrid][FULL & ~(self.pieces[1] | self.pieces[2])])
 
     def play(self, player, col, row):
-        self.grid[row][col] = player
+        bit = 1 << (col + row * 3)
+        self.pieces[player] |= bit
+        self.pieces[3 - player] &= ~bit
 
     def check_winner(self):
-        for i in range(3):
-            # check rows
-            if self.grid[i][0] > 0 and self.grid[i][0] == self.grid[i][1] and self.grid[i][0] == self.grid[i][2]:
-                return self.grid[i][0]
-            # check cols
-            if self.grid[0][i] > 0 and self.grid[0][i] == self.grid[1][i] and self.grid[1][i] == self.grid[2][i]:
-                return self.grid[0][i]
-        # check diagnoal 1
-        if self.grid[0][0] > 0 and self.grid[0][0] == self.grid[1][1] and self.grid[0][0] == self.grid[2][2]:
-            return self.grid[0][0]
-        # check diagnoal 2
-        if self.grid[2][0] > 0 and self.grid[2][0] == self.grid[1][1] and self.grid[2][0] == self.grid[0][2]:
-            return self.grid[2][0]
-
+        if SMALL_WIN[self.pieces[1]]:
+            return 1
+        if SMALL_WIN[self.pieces[2]]:
+            return 2
         return 0
-